@@ -0,0 +1,184 @@
+# app/admission.py
+"""
+Inbound admission control for /chat.
+
+A global cap on in-flight requests with a bounded, prioritized wait queue,
+plus per-session and per-IP token buckets. Requests that cannot be admitted
+are rejected quickly with RateLimited so the endpoint can answer 429 with a
+Retry-After header instead of piling up work.
+"""
+import os
+import math
+import heapq
+import asyncio
+import itertools
+from collections import OrderedDict
+from typing import Dict, Any, List, Optional, Tuple
+from token_bucket import TokenBucket
+
+MAX_IN_FLIGHT = int(os.environ.get("CHAT_MAX_IN_FLIGHT", "16"))
+MAX_QUEUE = int(os.environ.get("CHAT_MAX_QUEUE", "32"))
+QUEUE_TIMEOUT = float(os.environ.get("CHAT_QUEUE_TIMEOUT", "10"))
+SESSION_RATE = float(os.environ.get("CHAT_SESSION_RATE", "0.5"))  # requests per second
+SESSION_BURST = float(os.environ.get("CHAT_SESSION_BURST", "5"))
+IP_RATE = float(os.environ.get("CHAT_IP_RATE", "2"))
+IP_BURST = float(os.environ.get("CHAT_IP_BURST", "20"))
+MAX_TRACKED_KEYS = 10000
+
+# Priorities: lower values are admitted first
+PRIORITY_SHORT = 0
+PRIORITY_NORMAL = 1
+
+class RateLimited(Exception):
+    """Raised when a request is not admitted; carries the suggested Retry-After"""
+
+    def __init__(self, reason: str, retry_after: float):
+        super().__init__(reason)
+        self.reason = reason
+        self.retry_after = max(1, math.ceil(retry_after))
+
+class BucketRegistry:
+    """Token buckets keyed by session or IP, evicting the least recently used"""
+
+    def __init__(self, rate: float, capacity: float, max_keys: int = MAX_TRACKED_KEYS):
+        self.rate = rate
+        self.capacity = capacity
+        self.max_keys = max_keys
+        self.buckets: "OrderedDict[str, TokenBucket]" = OrderedDict()
+
+    def try_take(self, key: str) -> float:
+        bucket = self.buckets.get(key)
+        if bucket is None:
+            bucket = self.buckets[key] = TokenBucket(self.rate, self.capacity)
+            if len(self.buckets) > self.max_keys:
+                self.buckets.popitem(last=False)
+        else:
+            self.buckets.move_to_end(key)
+        return bucket.try_take()
+
+class SessionLocks:
+    """
+    One turn at a time per session: concurrent turns would share the same
+    messages and context. A session's lock only exists while one of its
+    turns is running or waiting, so random session ids cannot grow the map.
+    """
+
+    def __init__(self):
+        self.locks: Dict[str, asyncio.Lock] = {}
+        self.users: Dict[str, int] = {}
+
+    async def acquire(self, session_id: str, timeout: Optional[float] = None):
+        """
+        Wait for the session's previous turn to finish.
+
+        Raises:
+            RateLimited: If it is still running after `timeout` seconds
+        """
+        lock = self.locks.setdefault(session_id, asyncio.Lock())
+        self.users[session_id] = self.users.get(session_id, 0) + 1
+        try:
+            await asyncio.wait_for(lock.acquire(), timeout)
+        except asyncio.TimeoutError:
+            self._drop(session_id)
+            raise RateLimited("The previous message in this session is still being answered", 1)
+        except BaseException:
+            self._drop(session_id)
+            raise
+
+    def release(self, session_id: str):
+        self.locks[session_id].release()
+        self._drop(session_id)
+
+    def _drop(self, session_id: str):
+        self.users[session_id] -= 1
+        if self.users[session_id] == 0:
+            del self.users[session_id]
+            del self.locks[session_id]
+
+def classify_priority(message: str) -> int:
+    """Short messages (likely clarification) are cheap, so admit them first"""
+    return PRIORITY_SHORT if len(message.split()) <= 3 else PRIORITY_NORMAL
+
+class AdmissionController:
+    """Global in-flight cap with a bounded priority wait queue and rate limits"""
+
+    def __init__(self, max_in_flight: int = MAX_IN_FLIGHT, max_queue: int = MAX_QUEUE,
+                 queue_timeout: float = QUEUE_TIMEOUT):
+        self.max_in_flight = max_in_flight
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.in_flight = 0
+        self._waiters: List[Tuple[int, int, asyncio.Future]] = []
+        self._counter = itertools.count()
+        self.session_buckets = BucketRegistry(SESSION_RATE, SESSION_BURST)
+        self.ip_buckets = BucketRegistry(IP_RATE, IP_BURST)
+        self.stats = {"admitted": 0, "queued": 0, "rejected_rate": 0, "rejected_overload": 0}
+
+    def check_rate(self, session_id: Optional[str], client_ip: Optional[str]):
+        """Apply per-IP and per-session token buckets"""
+        if client_ip:
+            wait = self.ip_buckets.try_take(client_ip)
+            if wait:
+                self.stats["rejected_rate"] += 1
+                raise RateLimited("Too many requests from this client", wait)
+        if session_id:
+            wait = self.session_buckets.try_take(session_id)
+            if wait:
+                self.stats["rejected_rate"] += 1
+                raise RateLimited("Too many requests for this session", wait)
+
+    async def acquire(self, priority: int = PRIORITY_NORMAL, timeout: Optional[float] = None):
+        """
+        Take an in-flight slot, waiting in the bounded queue if necessary.
+
+        The wait is bounded by queue_timeout, or by `timeout` when shorter
+        (the time left in the request budget).
+        """
+        if self.in_flight < self.max_in_flight and not self._waiters:
+            self.in_flight += 1
+            self.stats["admitted"] += 1
+            return
+        if len(self._waiters) >= self.max_queue:
+            self.stats["rejected_overload"] += 1
+            raise RateLimited("Server is overloaded", self.queue_timeout / 2)
+
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (priority, next(self._counter), future))
+        self.stats["queued"] += 1
+        try:
+            # The slot is handed over by release(), so in_flight is already counted
+            await asyncio.wait_for(future, self.queue_timeout if timeout is None else min(self.queue_timeout, timeout))
+        except asyncio.TimeoutError:
+            if future.done() and not future.cancelled():
+                # The slot was handed over in the same tick as the timeout; give it back
+                self.release()
+            else:
+                self._remove_waiter(future)
+            self.stats["rejected_overload"] += 1
+            raise RateLimited("Timed out waiting for capacity", self.queue_timeout / 2)
+        except asyncio.CancelledError:
+            # Client went away; give back a slot that was already handed over
+            if future.done() and not future.cancelled():
+                self.release()
+            else:
+                self._remove_waiter(future)
+            raise
+        self.stats["admitted"] += 1
+
+    def release(self):
+        """Release a slot, handing it to the highest-priority waiter if any"""
+        while self._waiters:
+            _, _, future = heapq.heappop(self._waiters)
+            if not future.done():
+                future.set_result(None)
+                return
+        self.in_flight -= 1
+
+    def _remove_waiter(self, future: asyncio.Future):
+        self._waiters = [w for w in self._waiters if w[2] is not future]
+        heapq.heapify(self._waiters)
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Return current load and counters"""
+        return dict(self.stats, in_flight=self.in_flight, waiting=len(self._waiters),
+                    max_in_flight=self.max_in_flight, max_queue=self.max_queue)
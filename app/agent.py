@@ -1,17 +1,23 @@
 import os
 import json
-import requests
 import time
 import logging
-from typing import Dict, Any, List, Optional, TypedDict, Annotated
+import threading
+import contextvars
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FuturesTimeoutError
+from typing import Dict, Any, List, Optional, Tuple, TypedDict, Annotated
 from pydantic import BaseModel, Field
-from langsmith import traceable
 from langgraph.graph import StateGraph, END
 from langchain_core.prompts import ChatPromptTemplate
 from langchain_google_genai import ChatGoogleGenerativeAI
 from langchain_core.output_parsers import StrOutputParser
+from tracing import traced, config as tracing_config
 from tools.code_executor import execute_code_in_container
 from tools.retriever import setup_chroma_retriever
+from deadline import DeadlineExceeded, RESPONSE_RESERVE_SECONDS, timeout_for
+from tools.preflight import run_preflight, fix_cache
+from tools.code_extractor import extract_code, CONFIDENCE_THRESHOLD as EXTRACTION_CONFIDENCE_THRESHOLD
+from llm_scheduler import llm_scheduler, estimate_tokens, PRIORITY_RESPOND, PRIORITY_AUXILIARY
 
 # Configure logging
 logging.basicConfig(
@@ -23,15 +29,17 @@ logging.basicConfig(
 )
 logger = logging.getLogger("python-tutor-agent")
 
-# Configure LangSmith tracing
-os.environ["LANGCHAIN_TRACING_V2"] = "true"
-os.environ["LANGCHAIN_PROJECT"] = "python-tutor-agent"
-if not os.environ.get("LANGCHAIN_ENDPOINT"):
-    os.environ["LANGCHAIN_ENDPOINT"] = "https://api.smith.langchain.com"
-logger.info(f"LangSmith tracing enabled for project: {os.environ.get('LANGCHAIN_PROJECT')}")
+# Tracing is configured from the environment by the tracing module (TRACING_MODE, TRACE_SAMPLE_RATE)
+logger.info(f"Tracing mode: {tracing_config['mode']} (sample rate {tracing_config['sample_rate']})")
 
 # Initialize vector retriever
 retriever = setup_chroma_retriever()
+RETRIEVAL_TIMEOUT = 10
+# Retrieval runs in a worker so it can be abandoned when the deadline is near
+retrieval_pool = ThreadPoolExecutor(max_workers=4, thread_name_prefix="retrieval")
+
+# Sandbox execution timeout in seconds (also the code-executor default)
+EXECUTION_TIMEOUT = int(os.environ.get("EXECUTION_TIMEOUT", "5"))
 
 # Define message type
 class Message(TypedDict):
@@ -44,67 +52,139 @@ class AgentState(TypedDict):
     next_step: str
     context: Dict[str, Any]
 
+# Model profiles for each call site. Each profile maps to a model_name entry in
+# litellm-config/config.yaml; short structured tasks use the fast profile with
+# tight output caps, the final answer uses the full model. When the outbound
+# scheduler is saturated, the final answer is scheduled before auxiliary calls.
+MODEL_PROFILES = {
+    "extract": {"model": "tutor-fast", "direct_model": "gemini-2.0-flash-lite", "max_tokens": 512, "timeout": 10,
+                "priority": PRIORITY_AUXILIARY},
+    "fix": {"model": "tutor-fast", "direct_model": "gemini-2.0-flash-lite", "max_tokens": 1024, "timeout": 15,
+            "priority": PRIORITY_AUXILIARY},
+    "clarify": {"model": "tutor-fast", "direct_model": "gemini-2.0-flash-lite", "max_tokens": 256, "timeout": 10,
+                "priority": PRIORITY_AUXILIARY},
+    "respond": {"model": "tutor-full", "direct_model": "gemini-2.0-flash", "max_tokens": 2048, "timeout": 30,
+                "priority": PRIORITY_RESPOND},
+}
+DEFAULT_PROFILE = "respond"
+
+LITELLM_URL = os.environ.get("LITELLM_URL", "http://litellm:4000/v1/chat/completions")
+
+# Per-profile latency statistics, exposed through the /metrics endpoint
+llm_latency_stats: Dict[str, Dict[str, float]] = {}
+# The graph runs in worker threads (/chat threadpool, /chat/batch to_thread)
+_stats_lock = threading.Lock()
+
+def record_llm_latency(profile: str, elapsed: float, source: str):
+    """Record the latency of a completed LLM call for a profile"""
+    with _stats_lock:
+        stats = llm_latency_stats.setdefault(profile, {
+            "calls": 0, "total_seconds": 0.0, "max_seconds": 0.0, "direct_api_calls": 0
+        })
+        stats["calls"] += 1
+        stats["total_seconds"] += elapsed
+        stats["max_seconds"] = max(stats["max_seconds"], elapsed)
+        if source == "direct":
+            stats["direct_api_calls"] += 1
+    logger.info(f"LLM call [{profile}] via {source} took {elapsed:.2f}s")
+
+def get_llm_latency_stats() -> Dict[str, Dict[str, float]]:
+    """Return per-profile latency statistics with averages"""
+    report = {}
+    with _stats_lock:
+        snapshot = {profile: dict(stats) for profile, stats in llm_latency_stats.items()}
+    for profile, stats in snapshot.items():
+        report[profile] = dict(stats)
+        report[profile]["avg_seconds"] = stats["total_seconds"] / stats["calls"] if stats["calls"] else 0.0
+    return report
+
+# How execute_code obtained the code: fenced block, regex pattern, AST extractor or LLM
+extraction_stats: Dict[str, int] = {"fenced": 0, "pattern": 0, "ast": 0, "llm": 0}
+
+def record_extraction(source: str):
+    """Count how code was extracted for one execute_code call"""
+    with _stats_lock:
+        extraction_stats[source] += 1
+
+def get_extraction_stats() -> Dict[str, Any]:
+    """Return code extraction counts and the share that needed an LLM call"""
+    with _stats_lock:
+        stats = dict(extraction_stats)
+    total = sum(stats.values())
+    return dict(stats, total=total, llm_rate=stats["llm"] / total if total else 0.0)
+
 # Get LLM
-def get_llm(temperature=0.2):
+def get_llm(temperature=0.2, model="gemini-2.0-flash", max_tokens=None, timeout=None):
     """Get a direct LLM instance"""
-    logger.info("Getting LLM instance")
+    logger.info(f"Getting LLM instance for {model}")
     return ChatGoogleGenerativeAI(
-        model="gemini-2.0-flash",
+        model=model,
         temperature=temperature,
+        max_output_tokens=max_tokens,
+        timeout=timeout,
         google_api_key=os.environ.get("GOOGLE_API_KEY")
     )
 
-# Define a direct LLM call function
-def call_llm(messages: List[Dict[str, str]], temperature: float = 0.2) -> str:
-    """Call LLM via local LiteLLM server with fallback to direct API"""
-    logger.info("Calling LLM")
-    # Try the LiteLLM service first
-    max_retries = 3
-    for attempt in range(max_retries):
-        try:
-            response = requests.post(
-                "http://litellm:4000/v1/chat/completions",
-                json={
-                    "model": "gemini/gemini-2.0-flash",  # Use the full model name in the format expected by LiteLLM
-                    "messages": messages,
-                    "temperature": temperature
-                },
-                headers={
-                    "Content-Type": "application/json",
-                    # Uncomment and use if you set a master key in config.yaml
-                    # "Authorization": f"Bearer {os.environ.get('LITELLM_MASTER_KEY', '')}"
-                },
-                timeout=30  # Longer timeout
-            )
-            
-            if response.status_code == 200:
-                logger.info("Using LiteLLM service")
-                return response.json()["choices"][0]["message"]["content"]
-            else:
-                logger.error(f"LiteLLM error (attempt {attempt+1}/{max_retries}): {response.status_code}")
-                logger.error(f"Response content: {response.text}")
-                if attempt == max_retries - 1:
-                    # Last attempt, fall back to direct API
-                    raise Exception(f"LiteLLM error after {max_retries} attempts: {response.text}")
-                # Wait before retrying
-                time.sleep(2)
-        except Exception as e:
-            if attempt == max_retries - 1:
-                logger.error(f"All LiteLLM attempts failed, using direct API: {e}")
-                # Fall back to direct API call on the last attempt
-                llm = get_llm(temperature)
-                response = llm.invoke([{"role": m["role"], "content": m["content"]} for m in messages])
-                return response.content
-            logger.error(f"LiteLLM attempt {attempt+1} failed: {e}")
-            time.sleep(2)  # Wait before retry
-    
-    # If we get here, all retries failed
-    llm = get_llm(temperature)
+def _call_direct_api(messages: List[Dict[str, str]], temperature: float, config: Dict[str, Any], timeout: float) -> str:
+    """Call the model directly, bypassing LiteLLM"""
+    llm = get_llm(temperature, model=config["direct_model"], max_tokens=config["max_tokens"], timeout=timeout)
     response = llm.invoke([{"role": m["role"], "content": m["content"]} for m in messages])
     return response.content
 
+# Define a direct LLM call function
+def call_llm(messages: List[Dict[str, str]], temperature: float = 0.2, profile: str = DEFAULT_PROFILE,
+             deadline: Optional[float] = None, reserve: float = 0.0) -> str:
+    """
+    Call LLM via local LiteLLM server with fallback to direct API.
+    
+    Every attempt is bounded by the request deadline, keeping `reserve` seconds
+    for later steps; raises DeadlineExceeded when the budget is used up.
+    Attempts go through the outbound scheduler, which limits concurrency and
+    rate per model and pauses the model after a 429 for its Retry-After.
+    """
+    config = MODEL_PROFILES.get(profile, MODEL_PROFILES[DEFAULT_PROFILE])
+    logger.info(f"Calling LLM with profile {profile} ({config['model']})")
+    start_time = time.time()
+    estimated_tokens = estimate_tokens(messages, config["max_tokens"])
+    # Try the LiteLLM service first
+    try:
+        content = llm_scheduler.chat_completion(
+            LITELLM_URL,
+            {
+                "model": config["model"],  # model_name alias defined in litellm-config/config.yaml
+                "messages": messages,
+                "temperature": temperature,
+                "max_tokens": config["max_tokens"]
+            },
+            config["priority"],
+            estimated_tokens,
+            config["timeout"],
+            deadline=deadline,
+            reserve=reserve,
+            headers={
+                "Content-Type": "application/json",
+                # Uncomment and use if you set a master key in config.yaml
+                # "Authorization": f"Bearer {os.environ.get('LITELLM_MASTER_KEY', '')}"
+            }
+        )
+        logger.info("Using LiteLLM service")
+        record_llm_latency(profile, time.time() - start_time, "litellm")
+        return content
+    except DeadlineExceeded:
+        raise
+    except Exception as e:
+        logger.error(f"All LiteLLM attempts failed, using direct API: {e}")
+
+    # The direct API shares the model's quota, so it waits in the same lane
+    # (including any Retry-After pause) instead of adding to a rate-limit storm
+    request_timeout = timeout_for(deadline, config["timeout"], reserve)
+    with llm_scheduler.slot(config["model"], config["priority"], estimated_tokens, request_timeout):
+        content = _call_direct_api(messages, temperature, config, timeout_for(deadline, config["timeout"], reserve))
+    record_llm_latency(profile, time.time() - start_time, "direct")
+    return content
+
 # Router function
-@traceable(name="route_query")
+@traced(name="route_query")
 def route_query(state: AgentState) -> AgentState:
     """Determine the next step based on the user query"""
     logger.info("Routing query")
@@ -162,8 +242,24 @@ def route_query(state: AgentState) -> AgentState:
         is_execution_request = True
         logger.info(f"Detected math in knowledge request, prioritizing code execution. Math detected: {has_math}")
     
+    # Check for performance questions ("why is my code slow?") about included code
+    performance_keywords = [
+        "slow", "faster", "speed up", "performance", "profile", "bottleneck",
+        "optimize", "optimise", "memory usage", "takes so long", "too long"
+    ]
+    line_timing_keywords = ["line by line", "per line", "which line", "each line"]
+    is_performance_request = has_code and any(keyword in user_message.lower() for keyword in performance_keywords)
+    
     # Determine the next step
     if is_execution_request or has_code or has_math:
+        if is_performance_request:
+            # Profiling needs a real run, even if execution wasn't asked for
+            is_execution_request = True
+            is_line_timing = any(keyword in user_message.lower() for keyword in line_timing_keywords)
+            state["context"]["profile_mode"] = "lines" if is_line_timing else "cprofile"
+            logger.info(f"Detected performance question, profiling with {state['context']['profile_mode']}")
+        else:
+            state["context"]["profile_mode"] = None
         state["context"]["execution_explicitly_requested"] = is_execution_request
         logger.info("Next step: execute_code")
         return {"messages": messages, "next_step": "execute_code", "context": state["context"]}
@@ -174,7 +270,32 @@ def route_query(state: AgentState) -> AgentState:
         logger.info("Next step: ask_clarification")
         return {"messages": messages, "next_step": "ask_clarification", "context": state["context"]}
 
-@traceable(name="execute_code")
+def run_code_with_preflight(code: str, profile_mode: Optional[str] = None,
+                            deadline: Optional[float] = None) -> Tuple[str, List[str], Dict[str, Any]]:
+    """
+    Add missing imports and check syntax locally, then execute if the code compiles.
+    
+    Returns the code as run, the modules whose imports were added and the
+    execution result. The sandbox timeout is shortened to fit the request
+    deadline; raises DeadlineExceeded when there is no time left to run the code.
+    """
+    code, added_imports, syntax_error = run_preflight(code)
+    if added_imports:
+        logger.info(f"Added missing imports: {', '.join(added_imports)}")
+    
+    if syntax_error:
+        # No need for an executor round-trip to find a syntax error
+        logger.info("Syntax error found locally, skipping execution")
+        return code, added_imports, {"output": "", "success": False, "error": syntax_error, "execution_time": 0}
+    
+    # The HTTP timeout is the sandbox timeout plus 2 seconds
+    http_timeout = timeout_for(deadline, EXECUTION_TIMEOUT + 2, RESPONSE_RESERVE_SECONDS)
+    execution_timeout = int(http_timeout - 2)
+    if execution_timeout < 1:
+        raise DeadlineExceeded("Not enough time left to run the code")
+    return code, added_imports, execute_code_in_container(code, timeout=execution_timeout, profile=profile_mode)
+
+@traced(name="execute_code")
 def execute_code(state: AgentState) -> AgentState:
     """Extract and execute Python code from user message"""
     logger.info("Executing code")
@@ -182,6 +303,8 @@ def execute_code(state: AgentState) -> AgentState:
     user_message = messages[-1]["content"]
     context = state["context"]
     execution_explicitly_requested = context.get("execution_explicitly_requested", False)
+    profile_mode = context.get("profile_mode")
+    deadline = context.get("deadline")
     
     # Extract code directly using regex pattern matching
     import re
@@ -210,6 +333,7 @@ def execute_code(state: AgentState) -> AgentState:
                 # Wrap the expression in a print statement for execution
                 code = f"print({expression})"
                 logger.info(f"Extracted expression: {expression}")
+                record_extraction("pattern")
                 break
         else:
             # Check for mathematical expressions in the message
@@ -232,25 +356,37 @@ def execute_code(state: AgentState) -> AgentState:
                         expression = match.group(1).strip()
                         code = f"print({expression})"
                         logger.info(f"Extracted mathematical expression: {expression}")
+                        record_extraction("pattern")
                         break
             else:
-                # Assume the entire message might be code if it contains Python keywords
-                python_keywords = ["import", "def", "class", "for", "while", "if", "print", "return"]
-                if any(keyword in user_message for keyword in python_keywords):
-                    code = user_message
+                # Try the local AST-based extractor before paying for an LLM round-trip
+                extracted_code, confidence = extract_code(user_message)
+                if extracted_code and confidence >= EXTRACTION_CONFIDENCE_THRESHOLD:
+                    code = extracted_code
+                    record_extraction("ast")
+                    logger.info(f"AST extractor found code (confidence {confidence:.2f})")
                 else:
-                    # Fall back to LLM for code extraction if regex fails
+                    # Fall back to LLM for code extraction if the local extractor is unsure
                     llm_messages = [
                         {"role": "system", "content": """Extract the Python code or mathematical expression from this message. 
                         If it's a simple calculation or expression, wrap it in a print() statement.
                         Only output the code, nothing else."""},
                         {"role": "user", "content": user_message}
                     ]
-                    code = call_llm(llm_messages)
-                    logger.info(f"LLM extracted code: {code}")
+                    try:
+                        code = call_llm(llm_messages, profile="extract", deadline=deadline,
+                                        reserve=RESPONSE_RESERVE_SECONDS)
+                        record_extraction("llm")
+                        logger.info(f"LLM extracted code (AST confidence {confidence:.2f}): {code}")
+                    except DeadlineExceeded:
+                        # Use the low-confidence candidate rather than nothing
+                        code = extracted_code or ""
+                        context.setdefault("skipped_steps", []).append("code extraction")
+                        logger.info("Not enough time left for LLM code extraction")
     else:
         # Use the first code block found
         code = code_blocks[0]
+        record_extraction("fenced")
     
     # Clean the code - ensure no markdown markers are present
     # Remove any remaining triple backticks that might be in the code
@@ -264,53 +400,140 @@ def execute_code(state: AgentState) -> AgentState:
     context["extracted_code"] = code
     
     # Only execute the code if explicitly requested
-    if execution_explicitly_requested:
-        # Execute the code in isolated container
-        result = execute_code_in_container(code)
+    if execution_explicitly_requested and code.strip():
+        try:
+            # Execute the code in isolated container
+            code, added_imports, result = run_code_with_preflight(code, profile_mode, deadline)
+        except DeadlineExceeded:
+            logger.info("Not enough time left to execute the code")
+            context.setdefault("skipped_steps", []).append("code execution")
+            result = None
         
         # If there was an error, try to fix the code and re-execute
-        if not result.get("success", False) and "error" in result and result["error"]:
-            # Ask LLM to fix the code
-            llm_messages = [
-                {"role": "system", "content": "Fix the Python code that produced the following error. Only output the fixed code, nothing else."},
-                {"role": "user", "content": f"Code:\n{code}\n\nError:\n{result['error']}"}
-            ]
-            fixed_code = call_llm(llm_messages)
-            
-            # Clean the fixed code
-            fixed_code = re.sub(r'^```python\s*', '', fixed_code)
-            fixed_code = re.sub(r'^```\s*', '', fixed_code)
-            fixed_code = re.sub(r'\s*```$', '', fixed_code)
-            
+        fixed_code = None
+        if result and not result.get("success", False) and "error" in result and result["error"]:
+            # Reuse an earlier fix for the same mistake if we have one
+            fixed_code = fix_cache.get(code, result["error"])
+            if fixed_code is not None:
+                logger.info("Using cached fix")
+            else:
+                # Ask LLM to fix the code
+                llm_messages = [
+                    {"role": "system", "content": "Fix the Python code that produced the following error. Only output the fixed code, nothing else."},
+                    {"role": "user", "content": f"Code:\n{code}\n\nError:\n{result['error']}"}
+                ]
+                try:
+                    # Keep enough time to run the fix and answer afterwards
+                    fixed_code = call_llm(llm_messages, profile="fix", deadline=deadline,
+                                          reserve=RESPONSE_RESERVE_SECONDS + EXECUTION_TIMEOUT + 2)
+                    
+                    # Clean the fixed code
+                    fixed_code = re.sub(r'^```python\s*', '', fixed_code)
+                    fixed_code = re.sub(r'^```\s*', '', fixed_code)
+                    fixed_code = re.sub(r'\s*```$', '', fixed_code)
+                except DeadlineExceeded:
+                    logger.info("Not enough time left, skipping the fix attempt")
+                    context.setdefault("skipped_steps", []).append("code fix")
+        
+        fixed_result = None
+        if fixed_code is not None:
             logger.info(f"Fixed code: {fixed_code}")
             
-            # Re-execute the fixed code
-            fixed_result = execute_code_in_container(fixed_code)
+            try:
+                # Re-execute the fixed code
+                fixed_code, fixed_added_imports, fixed_result = run_code_with_preflight(fixed_code, profile_mode, deadline)
+            except DeadlineExceeded:
+                logger.info("Not enough time left to run the fixed code")
+                context.setdefault("skipped_steps", []).append("running the fixed code")
             
+            # Only remember fixes that actually worked
+            if fixed_result and fixed_result.get("success", False):
+                fix_cache.put(code, result["error"], fixed_code)
+        
+        if fixed_result is not None:
             # Store both attempts in context
             context["code_execution"] = {
                 "original_code": code,
                 "original_result": result.get("output", ""),
                 "original_success": result.get("success", False),
                 "original_error": result.get("error", ""),
+                "original_added_imports": added_imports,
                 "fixed_code": fixed_code,
                 "fixed_result": fixed_result.get("output", ""),
                 "fixed_success": fixed_result.get("success", False),
-                "fixed_error": fixed_result.get("error", "")
+                "fixed_error": fixed_result.get("error", ""),
+                "fixed_added_imports": fixed_added_imports,
+                "fixed_profile": fixed_result.get("profile")
             }
-        else:
+        elif result is not None:
             # Store original execution in context
             context["code_execution"] = {
                 "code": code,
                 "result": result.get("output", ""),
                 "success": result.get("success", False),
-                "error": result.get("error", "")
+                "error": result.get("error", ""),
+                "added_imports": added_imports,
+                "profile": result.get("profile")
             }
+        else:
+            context.pop("code_execution", None)
     
     logger.info("Next step: generate_response")
     return {"messages": messages, "next_step": "generate_response", "context": context}
 
-@traceable(name="retrieve_knowledge")
+def format_profile(profile: Dict[str, Any]) -> str:
+    """Format a profiling report from the code executor for the LLM prompt"""
+    if profile.get("error"):
+        return profile["error"]
+    
+    lines = [f"Total time: {profile.get('total_time', 0):.6f}s"]
+    if profile.get("timed_out"):
+        lines.append("The code hit the time limit; these numbers cover the run until it was stopped")
+    if profile.get("mode") == "lines":
+        lines.append("Line timings (line: hits, seconds, source):")
+        for entry in profile.get("lines", []):
+            lines.append(f"  {entry['line']}: {entry['hits']} hits, {entry['time']:.6f}s  {entry['source']}")
+        return "\n".join(lines)
+    
+    lines.append("Hot functions (by cumulative time):")
+    for func in profile.get("functions", []):
+        lines.append(
+            f"  {func['function']} ({func['file']}:{func['line']}): {func['calls']} calls, "
+            f"own {func['total_time']:.6f}s, cumulative {func['cumulative_time']:.6f}s"
+        )
+    memory = profile.get("memory", {})
+    if memory:
+        lines.append(f"Peak memory: {memory.get('peak_bytes', 0)} bytes")
+        lines.append("Allocation sites:")
+        for site in memory.get("allocation_sites", []):
+            lines.append(f"  {site['file']}:{site['line']}: {site['size_bytes']} bytes in {site['count']} blocks")
+    return "\n".join(lines)
+
+def format_added_imports(added_imports: Optional[List[str]]) -> str:
+    """Context line telling the LLM which imports preflight added before running the code"""
+    if not added_imports:
+        return ""
+    modules = ", ".join(added_imports)
+    statements = ", ".join(f"`import {module}`" for module in added_imports)
+    return (f"Note: The code used {modules} without importing it, so {statements} was added "
+            f"before running it. Mention that the import is needed.\n\n")
+
+def deadline_fallback_response(context: Dict[str, Any]) -> str:
+    """Short answer used when there is no time left for the final LLM call"""
+    response = "I'm sorry, I ran out of time preparing a full explanation."
+    code_exec = context.get("code_execution")
+    if code_exec:
+        if "original_code" in code_exec:
+            success, output, error = code_exec["fixed_success"], code_exec["fixed_result"], code_exec["fixed_error"]
+        else:
+            success, output, error = code_exec["success"], code_exec["result"], code_exec["error"]
+        if success:
+            response += f" Here is the output of your code:\n\n{output}"
+        else:
+            response += f" Running your code produced this error:\n\n{error}"
+    return response + "\n\nPlease try again for a detailed answer."
+
+@traced(name="retrieve_knowledge")
 def retrieve_knowledge(state: AgentState) -> AgentState:
     """Retrieve relevant Python knowledge"""
     logger.info("Retrieving knowledge")
@@ -318,8 +541,18 @@ def retrieve_knowledge(state: AgentState) -> AgentState:
     user_message = messages[-1]["content"]
     context = state["context"]
     
-    # Use invoke instead of get_relevant_documents
-    docs = retriever.invoke(user_message)
+    # Use invoke instead of get_relevant_documents, bounded by the request deadline
+    try:
+        retrieval_timeout = timeout_for(context.get("deadline"), RETRIEVAL_TIMEOUT, RESPONSE_RESERVE_SECONDS)
+        # Run in a copy of this context so the retriever stays part of the request's trace
+        docs = retrieval_pool.submit(
+            contextvars.copy_context().run, retriever.invoke, user_message
+        ).result(timeout=retrieval_timeout)
+    except (DeadlineExceeded, FuturesTimeoutError):
+        # Answer without docs rather than miss the deadline
+        logger.info("Not enough time left for knowledge retrieval, answering without docs")
+        context.setdefault("skipped_steps", []).append("knowledge retrieval")
+        docs = []
     
     # Store in context
     context["retrieved_docs"] = [
@@ -330,7 +563,7 @@ def retrieve_knowledge(state: AgentState) -> AgentState:
     logger.info("Next step: generate_response")
     return {"messages": messages, "next_step": "generate_response", "context": context}
 
-@traceable(name="ask_clarification")
+@traced(name="ask_clarification")
 def ask_clarification(state: AgentState) -> AgentState:
     """Ask the user for clarification"""
     logger.info("Asking for clarification")
@@ -344,7 +577,10 @@ def ask_clarification(state: AgentState) -> AgentState:
         {"role": "user", "content": user_message}
     ]
     
-    clarification = call_llm(llm_messages)
+    try:
+        clarification = call_llm(llm_messages, profile="clarify", deadline=context.get("deadline"))
+    except DeadlineExceeded:
+        clarification = "Could you tell me a bit more about what you'd like to learn or which code you're working on?"
     
     # Add to messages
     new_messages = messages.copy()
@@ -353,7 +589,7 @@ def ask_clarification(state: AgentState) -> AgentState:
     logger.info("Next step: END")
     return {"messages": new_messages, "next_step": "END", "context": context}
 
-@traceable(name="generate_response")
+@traced(name="generate_response")
 def generate_response(state: AgentState) -> AgentState:
     """Generate a response based on the context"""
     logger.info("Generating response")
@@ -376,6 +612,7 @@ def generate_response(state: AgentState) -> AgentState:
             code_exec = context["code_execution"]
             context_str += "\nCODE EXECUTION (ORIGINAL):\n"
             context_str += f"Code:\n{code_exec['original_code']}\n\n"
+            context_str += format_added_imports(code_exec.get("original_added_imports"))
             
             if code_exec["original_success"]:
                 context_str += f"Output:\n{code_exec['original_result']}\n"
@@ -384,28 +621,40 @@ def generate_response(state: AgentState) -> AgentState:
                 
             context_str += "\nCODE EXECUTION (FIXED):\n"
             context_str += f"Code:\n{code_exec['fixed_code']}\n\n"
+            context_str += format_added_imports(code_exec.get("fixed_added_imports"))
             
             if code_exec["fixed_success"]:
                 context_str += f"Output:\n{code_exec['fixed_result']}\n"
             else:
                 context_str += f"Error:\n{code_exec['fixed_error']}\n"
+            
+            if code_exec.get("fixed_profile"):
+                context_str += f"\nPERFORMANCE PROFILE:\n{format_profile(code_exec['fixed_profile'])}\n"
         
         # Case 2: Code was executed without fix attempt
         else:
             code_exec = context["code_execution"]
             context_str += "\nCODE EXECUTION:\n"
             context_str += f"Code:\n{code_exec['code']}\n\n"
+            context_str += format_added_imports(code_exec.get("added_imports"))
             
             if code_exec["success"]:
                 context_str += f"Output:\n{code_exec['result']}\n"
             else:
                 context_str += f"Error:\n{code_exec['error']}\n"
+            
+            if code_exec.get("profile"):
+                context_str += f"\nPERFORMANCE PROFILE:\n{format_profile(code_exec['profile'])}\n"
     
     # Case 3: Code was extracted but not executed (just provide an explanation)
     elif "extracted_code" in context and not execution_explicitly_requested:
         context_str += "\nEXTRACTED CODE (NOT EXECUTED):\n"
         context_str += f"Code:\n{context['extracted_code']}\n\n"
     
+    # Let the answer mention anything that was skipped to stay within the time budget
+    if context.get("skipped_steps"):
+        context_str += f"\nNOTE: Skipped to answer in time: {', '.join(context['skipped_steps'])}\n"
+    
     # Prepare system prompt based on the execution context
     system_prompt = """You're a helpful Python mentor. Based on the context and user's question,
     provide a clear, educational response with proper structure.
@@ -448,6 +697,14 @@ def generate_response(state: AgentState) -> AgentState:
         2. DO NOT repeat the code that was executed - it has already been run
         3. Format your response as a natural, conversational explanation with clear sections
         """
+        
+        if context.get("profile_mode"):
+            system_prompt += """
+        The code was profiled because the user asked about performance. Base your
+        explanation on the PERFORMANCE PROFILE data (hot functions, call counts,
+        cumulative times, memory allocation sites or per-line timings), point to the
+        actual bottleneck and suggest concrete optimizations.
+        """
     elif "extracted_code" in context and not execution_explicitly_requested:
         system_prompt += """
         
@@ -466,7 +723,10 @@ def generate_response(state: AgentState) -> AgentState:
         {"role": "user", "content": f"USER QUESTION: {user_message}\n\nCONTEXT:\n{context_str}"}
     ]
     
-    response = call_llm(llm_messages)
+    try:
+        response = call_llm(llm_messages, profile="respond", deadline=context.get("deadline"))
+    except DeadlineExceeded:
+        response = deadline_fallback_response(context)
     
     # Post-process the response to remove any markdown code blocks
     import re
@@ -482,7 +742,7 @@ def generate_response(state: AgentState) -> AgentState:
     logger.info("Next step: END")
     return {"messages": new_messages, "next_step": "END", "context": context}
 
-@traceable(name="direct_response")
+@traced(name="direct_response")
 def direct_response(state: AgentState) -> AgentState:
     """Provide a direct response to a simple question"""
     logger.info("Providing direct response")
@@ -496,7 +756,10 @@ def direct_response(state: AgentState) -> AgentState:
         {"role": "user", "content": user_message}
     ]
     
-    response = call_llm(llm_messages)
+    try:
+        response = call_llm(llm_messages, profile="respond", deadline=context.get("deadline"))
+    except DeadlineExceeded:
+        response = deadline_fallback_response(context)
     
     # Add to messages
     new_messages = messages.copy()
@@ -564,4 +827,9 @@ def create_agent():
     
     # Compile the workflow
     logger.info("Agent created")
-    return builder.compile()
\ No newline at end of file
+    return builder.compile()
+
+@traced(name="chat")
+def invoke_agent(agent, state: AgentState) -> AgentState:
+    """Run one turn through the graph under a single root span, so the turn is sampled as a whole"""
+    return agent.invoke(state)
@@ -0,0 +1,182 @@
+# app/batch.py
+"""
+Batch processing of tutor questions.
+
+Used by the POST /chat/batch endpoint and as a CLI for offline jobs:
+
+    python batch.py questions.jsonl --concurrency 8 > answers.jsonl
+
+Each input line is a JSON object with a "message" and an optional "id".
+Every message is answered as a fresh single-turn conversation; identical
+messages are only sent through the graph once. Results are written as JSONL
+in completion order, followed by a summary line with aggregate throughput.
+"""
+import os
+import sys
+import json
+import time
+import asyncio
+import logging
+import argparse
+from typing import Dict, Any, AsyncIterator, Iterable, Union
+from agent import create_agent, invoke_agent
+from deadline import start_deadline
+
+logger = logging.getLogger("python-tutor-agent")
+
+DEFAULT_BATCH_CONCURRENCY = int(os.environ.get("BATCH_CONCURRENCY", "8"))
+MAX_BATCH_CONCURRENCY = int(os.environ.get("BATCH_MAX_CONCURRENCY", "32"))
+# Graph runs in flight across all concurrent batches, so N batch clients can't multiply the load
+BATCH_MAX_IN_FLIGHT = int(os.environ.get("BATCH_MAX_IN_FLIGHT", "8"))
+batch_slots = asyncio.Semaphore(BATCH_MAX_IN_FLIGHT)
+
+def run_single_turn(agent, message: str) -> str:
+    """Run one message through the graph as a fresh conversation"""
+    state = {
+        "messages": [{"role": "user", "content": message}],
+        "next_step": "route",
+        "context": start_deadline({})
+    }
+    new_state = invoke_agent(agent, state)
+    assistant_messages = [m for m in new_state["messages"] if m["role"] == "assistant"]
+    return assistant_messages[-1]["content"] if assistant_messages else "I didn't understand that."
+
+async def iter_jsonl_lines(chunks: AsyncIterator[bytes]) -> AsyncIterator[bytes]:
+    """
+    Split a stream of byte chunks into lines.
+
+    Lines stay undecoded: process_batch decodes each one while parsing it, so
+    a line that is not valid UTF-8 only fails that item.
+    """
+    buffer = b""
+    async for chunk in chunks:
+        buffer += chunk
+        *lines, buffer = buffer.split(b"\n")
+        for line in lines:
+            yield line
+    if buffer:
+        yield buffer
+
+async def iter_file_lines(lines: Iterable[str]) -> AsyncIterator[str]:
+    """Adapt a synchronous line iterable (file, stdin) for process_batch"""
+    for line in lines:
+        yield line
+
+async def process_batch(lines: AsyncIterator[Union[str, bytes]], concurrency: int = DEFAULT_BATCH_CONCURRENCY) -> AsyncIterator[Dict[str, Any]]:
+    """
+    Process a stream of JSONL lines with bounded concurrency.
+
+    Args:
+        lines: Async iterator of JSONL lines (text or UTF-8 bytes), each {"id": ..., "message": ...}
+        concurrency: Maximum number of graph invocations running at once for this batch
+            (all batches together are capped at BATCH_MAX_IN_FLIGHT)
+
+    Yields:
+        One result dict per input line as it completes, then a summary dict
+    """
+    concurrency = max(1, min(concurrency, MAX_BATCH_CONCURRENCY))
+    agent = create_agent()
+    semaphore = asyncio.Semaphore(concurrency)
+    results: asyncio.Queue = asyncio.Queue()
+    inflight: Dict[str, asyncio.Future] = {}
+    stats = {"received": 0, "processed": 0, "deduplicated": 0, "errors": 0}
+    start_time = time.time()
+
+    async def run_one(message: str) -> Dict[str, Any]:
+        try:
+            response = await asyncio.to_thread(run_single_turn, agent, message)
+            return {"response": response}
+        except Exception as e:
+            logger.error(f"Batch item failed: {e}")
+            return {"error": str(e)}
+        finally:
+            batch_slots.release()
+            semaphore.release()
+
+    async def emit(item_id: Any, key: str, deduplicated: bool):
+        result = dict(await inflight[key])
+        result["id"] = item_id
+        if deduplicated:
+            result["deduplicated"] = True
+        await results.put(result)
+
+    async def produce():
+        pending = []
+        try:
+            async for line in lines:
+                if not line.strip():
+                    continue
+                stats["received"] += 1
+                try:
+                    # Bytes are decoded here; invalid UTF-8 raises UnicodeDecodeError (a ValueError)
+                    item = json.loads(line)
+                    message = item["message"]
+                    item_id = item.get("id", stats["received"])
+                    if not isinstance(message, str):
+                        raise TypeError("message must be a string")
+                except (ValueError, KeyError, TypeError, AttributeError) as e:
+                    await results.put({"id": stats["received"], "error": f"Invalid batch item: {e}"})
+                    continue
+
+                key = message.strip()
+                deduplicated = key in inflight
+                if not deduplicated:
+                    # Backpressure: stop reading input while the graph is saturated
+                    await semaphore.acquire()
+                    await batch_slots.acquire()
+                    inflight[key] = asyncio.ensure_future(run_one(message))
+                pending.append(asyncio.ensure_future(emit(item_id, key, deduplicated)))
+        except Exception as e:
+            # The input stream failed: still report the items already started
+            logger.error(f"Batch input failed: {e}")
+            await results.put({"id": None, "error": f"Batch input failed: {e}"})
+        try:
+            await asyncio.gather(*pending)
+        finally:
+            await results.put(None)
+
+    producer = asyncio.ensure_future(produce())
+    try:
+        while True:
+            result = await results.get()
+            if result is None:
+                break
+            if "error" in result:
+                stats["errors"] += 1
+            if result.get("deduplicated"):
+                stats["deduplicated"] += 1
+            stats["processed"] += 1
+            yield result
+        await producer
+    finally:
+        if not producer.done():
+            # The client went away: stop reading input so no new graph runs start.
+            # Runs already in worker threads finish and release their slots.
+            producer.cancel()
+
+    elapsed = time.time() - start_time
+    summary = dict(stats)
+    summary["unique_messages"] = len(inflight)
+    summary["concurrency"] = concurrency
+    summary["elapsed_seconds"] = round(elapsed, 3)
+    summary["items_per_second"] = round(stats["processed"] / elapsed, 3) if elapsed > 0 else 0.0
+    logger.info(f"Batch complete: {summary}")
+    yield {"summary": summary}
+
+async def _main(args):
+    with (open(args.input) if args.input != "-" else sys.stdin) as infile:
+        async for result in process_batch(iter_file_lines(infile), args.concurrency):
+            print(json.dumps(result), flush=True)
+            if "summary" in result:
+                print(f"Throughput: {result['summary']['items_per_second']} items/s "
+                      f"({result['summary']['processed']} items in {result['summary']['elapsed_seconds']}s)",
+                      file=sys.stderr)
+
+if __name__ == "__main__":
+    from dotenv import load_dotenv
+    load_dotenv()
+    parser = argparse.ArgumentParser(description="Run a JSONL file of questions through the Python tutor")
+    parser.add_argument("input", nargs="?", default="-", help="JSONL input file ('-' for stdin)")
+    parser.add_argument("--concurrency", type=int, default=DEFAULT_BATCH_CONCURRENCY,
+                        help="Maximum number of concurrent graph invocations")
+    asyncio.run(_main(parser.parse_args()))
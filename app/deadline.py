@@ -0,0 +1,52 @@
+# app/deadline.py
+"""
+Per-request deadline budget.
+
+main.chat sets an absolute deadline when the request arrives and stores it
+in the agent context; waiting for the session and for admission, graph nodes
+and outbound calls derive their timeouts from the remaining budget and skip
+optional work (the code-fix attempt, knowledge retrieval) when it runs low,
+keeping enough time to produce an answer.
+"""
+import os
+import time
+from typing import Dict, Any, Optional
+
+REQUEST_DEADLINE_SECONDS = float(os.environ.get("REQUEST_DEADLINE_SECONDS", "45"))
+# Budget kept back for the final generate_response call
+RESPONSE_RESERVE_SECONDS = float(os.environ.get("RESPONSE_RESERVE_SECONDS", "10"))
+# Below this, an outbound call is not worth starting
+MIN_CALL_SECONDS = 1.0
+
+class DeadlineExceeded(Exception):
+    """Raised when there is not enough budget left to start an outbound call"""
+
+def new_deadline(budget: float = REQUEST_DEADLINE_SECONDS) -> float:
+    """Absolute deadline for a request arriving now"""
+    return time.time() + budget
+
+def start_deadline(context: Dict[str, Any], budget: float = REQUEST_DEADLINE_SECONDS,
+                   deadline: Optional[float] = None) -> Dict[str, Any]:
+    """Set the deadline for this request in the agent context (a fresh one unless given)"""
+    context["deadline"] = deadline if deadline is not None else new_deadline(budget)
+    context["skipped_steps"] = []
+    return context
+
+def remaining(deadline: Optional[float]) -> float:
+    """Seconds left before the deadline (infinite when no deadline is set)"""
+    if deadline is None:
+        return float("inf")
+    return max(0.0, deadline - time.time())
+
+def timeout_for(deadline: Optional[float], cap: float, reserve: float = 0.0) -> float:
+    """
+    Timeout for an outbound call: the call's own cap, bounded by the budget
+    left after keeping `reserve` seconds for later steps.
+
+    Raises:
+        DeadlineExceeded: If less than MIN_CALL_SECONDS would be left
+    """
+    timeout = min(cap, remaining(deadline) - reserve)
+    if timeout < MIN_CALL_SECONDS:
+        raise DeadlineExceeded(f"Only {remaining(deadline):.1f}s left in the request budget")
+    return timeout
@@ -0,0 +1,239 @@
+# app/llm_scheduler.py
+"""
+Outbound scheduler for LLM calls.
+
+Every call_llm attempt, including the direct-API fallback, takes a slot
+from the lane of its model before it is sent. A lane enforces:
+
+- a maximum number of in-flight requests
+- token buckets for requests per minute and tokens per minute
+- Retry-After: after a 429 the whole lane pauses instead of every caller
+  retrying on its own
+- priority: waiting final-answer calls go before auxiliary calls
+  (extraction, fixes, clarification)
+
+Time spent waiting for a slot is reported per model and per priority.
+"""
+import os
+import time
+import heapq
+import logging
+import itertools
+import threading
+import requests
+from contextlib import contextmanager
+from typing import Dict, Any, List, Optional, Tuple
+from token_bucket import TokenBucket
+from deadline import DeadlineExceeded, remaining, timeout_for
+
+logger = logging.getLogger("python-tutor-agent")
+
+MAX_IN_FLIGHT_PER_MODEL = int(os.environ.get("LLM_MAX_IN_FLIGHT", "8"))
+REQUESTS_PER_MINUTE = float(os.environ.get("LLM_REQUESTS_PER_MINUTE", "300"))
+TOKENS_PER_MINUTE = float(os.environ.get("LLM_TOKENS_PER_MINUTE", "1000000"))
+DEFAULT_RETRY_AFTER = 2.0
+
+# Priorities: lower values are scheduled first
+PRIORITY_RESPOND = 0
+PRIORITY_AUXILIARY = 1
+
+def estimate_tokens(messages: List[Dict[str, str]], max_tokens: int) -> int:
+    """Rough token estimate for a request: ~4 characters per prompt token plus the output cap"""
+    return sum(len(m["content"]) for m in messages) // 4 + max_tokens
+
+def parse_retry_after(value: Optional[str]) -> float:
+    """Parse a Retry-After header given in seconds, with a default when missing"""
+    try:
+        return max(0.0, float(value))
+    except (TypeError, ValueError):
+        return DEFAULT_RETRY_AFTER
+
+class ModelLane:
+    """Concurrency limit, rate limits and priority queue for one model"""
+
+    def __init__(self, model: str, max_in_flight: int = MAX_IN_FLIGHT_PER_MODEL,
+                 requests_per_minute: float = REQUESTS_PER_MINUTE, tokens_per_minute: float = TOKENS_PER_MINUTE):
+        self.model = model
+        self.max_in_flight = max_in_flight
+        self.request_bucket = TokenBucket(requests_per_minute / 60, max(1.0, requests_per_minute / 60))
+        # The token budget is a full minute, as providers count it
+        self.token_bucket = TokenBucket(tokens_per_minute / 60, tokens_per_minute)
+        self.in_flight = 0
+        self.blocked_until = 0.0
+        self._condition = threading.Condition()
+        self._waiters: List[Tuple[int, int]] = []
+        self._counter = itertools.count()
+        self.stats = {
+            "requests": 0, "rate_limited": 0, "timeouts": 0,
+            "queue_seconds": {PRIORITY_RESPOND: 0.0, PRIORITY_AUXILIARY: 0.0},
+            "max_queue_seconds": 0.0,
+        }
+
+    def _wait_time(self, tokens: int) -> float:
+        """Seconds until this request may start (0 when it can start now)"""
+        if self.in_flight >= self.max_in_flight:
+            return float("inf")  # Woken up by release()
+        blocked = self.blocked_until - time.monotonic()
+        if blocked > 0:
+            return blocked
+        # A request larger than the whole budget waits for a full bucket, then
+        # is charged in full (see acquire) so later requests pay off the excess
+        tokens = min(tokens, self.token_bucket.capacity)
+        return max(self.request_bucket.wait_time(1), self.token_bucket.wait_time(tokens))
+
+    def acquire(self, priority: int, tokens: int, timeout: float) -> float:
+        """
+        Wait for a slot; returns the time spent queueing.
+
+        Raises:
+            DeadlineExceeded: If no slot is available within `timeout` seconds
+        """
+        start = time.monotonic()
+        entry = (priority, next(self._counter))
+        with self._condition:
+            heapq.heappush(self._waiters, entry)
+            try:
+                while True:
+                    wait = self._wait_time(tokens) if self._waiters[0] == entry else float("inf")
+                    if wait == 0:
+                        heapq.heappop(self._waiters)
+                        self.request_bucket.try_take(1)
+                        self.token_bucket.tokens -= tokens  # May go negative
+                        self.in_flight += 1
+                        break
+                    left = timeout - (time.monotonic() - start)
+                    if left <= 0:
+                        self.stats["timeouts"] += 1
+                        raise DeadlineExceeded(f"Timed out waiting for an LLM slot for {self.model}")
+                    self._condition.wait(min(wait, left))
+            finally:
+                if entry in self._waiters:
+                    self._waiters.remove(entry)
+                    heapq.heapify(self._waiters)
+                # The next waiter may be able to go now
+                self._condition.notify_all()
+
+            queued = time.monotonic() - start
+            self.stats["requests"] += 1
+            self.stats["queue_seconds"][priority] = self.stats["queue_seconds"].get(priority, 0.0) + queued
+            self.stats["max_queue_seconds"] = max(self.stats["max_queue_seconds"], queued)
+            return queued
+
+    def release(self):
+        with self._condition:
+            self.in_flight -= 1
+            self._condition.notify_all()
+
+    def backoff(self, retry_after: float):
+        """Pause the whole lane after a 429, honoring Retry-After"""
+        with self._condition:
+            self.stats["rate_limited"] += 1
+            self.blocked_until = max(self.blocked_until, time.monotonic() + retry_after)
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._condition:
+            return {
+                "in_flight": self.in_flight,
+                "waiting": len(self._waiters),
+                "blocked_for": round(max(0.0, self.blocked_until - time.monotonic()), 3),
+                "requests": self.stats["requests"],
+                "rate_limited": self.stats["rate_limited"],
+                "timeouts": self.stats["timeouts"],
+                "queue_seconds": {
+                    "respond" if priority == PRIORITY_RESPOND else "auxiliary": round(seconds, 3)
+                    for priority, seconds in self.stats["queue_seconds"].items()
+                },
+                "max_queue_seconds": round(self.stats["max_queue_seconds"], 3),
+            }
+
+class LLMScheduler:
+    """Shared scheduler holding one lane per model"""
+
+    def __init__(self, max_in_flight: int = MAX_IN_FLIGHT_PER_MODEL,
+                 requests_per_minute: float = REQUESTS_PER_MINUTE, tokens_per_minute: float = TOKENS_PER_MINUTE):
+        self.max_in_flight = max_in_flight
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self.lanes: Dict[str, ModelLane] = {}
+        self._lock = threading.Lock()
+
+    def lane(self, model: str) -> ModelLane:
+        with self._lock:
+            if model not in self.lanes:
+                self.lanes[model] = ModelLane(model, self.max_in_flight, self.requests_per_minute, self.tokens_per_minute)
+            return self.lanes[model]
+
+    @contextmanager
+    def slot(self, model: str, priority: int, tokens: int, timeout: float):
+        """Hold a slot in the model's lane for the duration of one request; yields the queue time"""
+        lane = self.lane(model)
+        queued = lane.acquire(priority, tokens, timeout)
+        try:
+            yield queued
+        finally:
+            lane.release()
+
+    def backoff(self, model: str, retry_after: float):
+        self.lane(model).backoff(retry_after)
+
+    def chat_completion(self, url: str, payload: Dict[str, Any], priority: int, tokens: int, timeout: float,
+                        deadline: Optional[float] = None, reserve: float = 0.0, max_retries: int = 3,
+                        headers: Optional[Dict[str, str]] = None) -> str:
+        """
+        POST a chat completion to LiteLLM through the model's lane, with retries.
+
+        A 429 pauses the lane for its Retry-After and the retry waits in the
+        lane; other errors are retried after a short sleep.
+
+        Args:
+            url: LiteLLM chat completions endpoint
+            payload: Request body; payload["model"] selects the lane
+            priority: PRIORITY_RESPOND or PRIORITY_AUXILIARY
+            tokens: Estimated tokens for the tokens-per-minute budget
+            timeout: Per-attempt timeout cap, further bounded by the deadline
+
+        Returns:
+            The message content of the first choice
+
+        Raises:
+            DeadlineExceeded: If the request budget runs out
+            Exception: The last error once all attempts failed
+        """
+        model = payload["model"]
+        last_error: Exception = Exception("LiteLLM was not called")
+        for attempt in range(max_retries):
+            request_timeout = timeout_for(deadline, timeout, reserve)
+            try:
+                # Wait for a slot no longer than the call itself may take
+                with self.slot(model, priority, tokens, request_timeout) as queued:
+                    if queued > 0.1:
+                        logger.info(f"LLM call for {model} queued for {queued:.2f}s")
+                    response = requests.post(url, json=payload, headers=headers,
+                                             timeout=timeout_for(deadline, timeout, reserve))
+                    if response.status_code == 429:
+                        # Pause every call to this model before giving up the slot, so no
+                        # waiting call slips in; the next attempt waits in the lane
+                        retry_after = parse_retry_after(response.headers.get("Retry-After"))
+                        logger.warning(f"LLM rate limited for {model}, backing off {retry_after:.1f}s")
+                        self.backoff(model, retry_after)
+                if response.status_code == 200:
+                    return response.json()["choices"][0]["message"]["content"]
+                logger.error(f"LiteLLM error (attempt {attempt+1}/{max_retries}): {response.status_code}")
+                logger.error(f"Response content: {response.text}")
+                last_error = Exception(f"LiteLLM error {response.status_code}: {response.text}")
+                if response.status_code == 429:
+                    continue
+            except DeadlineExceeded:
+                raise
+            except Exception as e:
+                logger.error(f"LiteLLM attempt {attempt+1} failed: {e}")
+                last_error = e
+            if attempt < max_retries - 1:
+                # Wait before retrying, if the budget allows it
+                time.sleep(min(2, remaining(deadline)))
+        raise last_error
+
+    def stats(self) -> Dict[str, Any]:
+        return {model: lane.snapshot() for model, lane in list(self.lanes.items())}
+
+llm_scheduler = LLMScheduler()
@@ -1,12 +1,22 @@
 from fastapi import FastAPI, Request, Form, Depends
 from fastapi.templating import Jinja2Templates
 from fastapi.staticfiles import StaticFiles
+from fastapi.responses import StreamingResponse, JSONResponse
+from fastapi.concurrency import run_in_threadpool
 from pydantic import BaseModel
 from typing import Dict, Any, List, Optional
 import os
 from dotenv import load_dotenv
-from agent import create_agent, AgentState
+from agent import create_agent, invoke_agent, AgentState, get_llm_latency_stats, get_extraction_stats
+from tools.code_executor import executor_pool
+from tools.preflight import get_preflight_stats
+from tracing import get_tracing_stats
+from llm_scheduler import llm_scheduler
 import uuid
+import json
+from batch import process_batch, iter_jsonl_lines, DEFAULT_BATCH_CONCURRENCY
+from deadline import new_deadline, start_deadline, remaining, RESPONSE_RESERVE_SECONDS
+from admission import AdmissionController, RateLimited, SessionLocks, classify_priority
 
 # Load environment variables
 load_dotenv()
@@ -19,6 +29,11 @@ templates = Jinja2Templates(directory="templates")
 
 # Store active sessions
 sessions = {}
+# One turn at a time per session
+session_locks = SessionLocks()
+
+# Admission control for /chat
+admission = AdmissionController()
 
 class ChatMessage(BaseModel):
     message: str
@@ -34,11 +49,49 @@ async def get_home(request: Request):
     return templates.TemplateResponse("index.html", {"request": request})
 
 @app.post("/chat", response_model=ChatResponse)
-async def chat(chat_message: ChatMessage):
+async def chat(chat_message: ChatMessage, request: Request):
     """Process a chat message"""
+    # Reject early, before any LLM or executor work is started
+    try:
+        client_ip = request.client.host if request.client else None
+        admission.check_rate(chat_message.session_id, client_ip)
+    except RateLimited as e:
+        return rate_limited_response(e)
+
+    # The time budget starts now, so waiting for the session and for capacity counts against it
+    deadline = new_deadline()
+    session_id = chat_message.session_id or str(uuid.uuid4())
+    try:
+        await session_locks.acquire(session_id, wait_budget(deadline))
+    except RateLimited as e:
+        return rate_limited_response(e)
+    try:
+        try:
+            await admission.acquire(classify_priority(chat_message.message), wait_budget(deadline))
+        except RateLimited as e:
+            return rate_limited_response(e)
+        try:
+            return await run_chat_turn(chat_message, session_id, deadline)
+        finally:
+            admission.release()
+    finally:
+        session_locks.release(session_id)
+
+def wait_budget(deadline: float) -> float:
+    """How long a turn may still wait for its session or a slot and be answered in time"""
+    return max(0.0, remaining(deadline) - RESPONSE_RESERVE_SECONDS)
+
+def rate_limited_response(e: RateLimited) -> JSONResponse:
+    """429 response with the suggested Retry-After"""
+    return JSONResponse(
+        status_code=429,
+        content={"detail": e.reason},
+        headers={"Retry-After": str(e.retry_after)}
+    )
+
+async def run_chat_turn(chat_message: ChatMessage, session_id: str, deadline: float) -> ChatResponse:
+    """Run one turn of a session through the agent graph"""
     try:
-        session_id = chat_message.session_id or str(uuid.uuid4())
-        
         # Get or create agent state with new structure
         if session_id not in sessions:
             sessions[session_id] = {
@@ -52,9 +105,13 @@ async def chat(chat_message: ChatMessage):
         # Add user message to state
         state["messages"].append({"role": "user", "content": chat_message.message})
         
+        # Every turn gets its own time budget, carried through the graph in the context
+        start_deadline(state["context"], deadline=deadline)
+        
         # Run agent
         agent = create_agent()
-        new_state = agent.invoke(state)
+        # Run the graph in a worker thread so the event loop keeps serving requests
+        new_state = await run_in_threadpool(invoke_agent, agent, state)
         
         # Update session state
         sessions[session_id] = new_state
@@ -72,11 +129,38 @@ async def chat(chat_message: ChatMessage):
             session_id=chat_message.session_id or str(uuid.uuid4())
         )
 
+@app.post("/chat/batch")
+async def chat_batch(request: Request, concurrency: int = DEFAULT_BATCH_CONCURRENCY):
+    """Process a JSONL stream of messages, streaming JSONL results as they complete"""
+    # Batches count against the client's IP bucket; graph runs are capped across all batches
+    try:
+        admission.check_rate(None, request.client.host if request.client else None)
+    except RateLimited as e:
+        return rate_limited_response(e)
+
+    async def result_lines():
+        async for result in process_batch(iter_jsonl_lines(request.stream()), concurrency):
+            yield json.dumps(result) + "\n"
+    return StreamingResponse(result_lines(), media_type="application/x-ndjson")
+
 @app.get("/sessions")
 async def get_sessions():
     """Get active sessions (for debugging)"""
     return {"session_count": len(sessions), "session_ids": list(sessions.keys())}
 
+@app.get("/metrics")
+async def get_metrics():
+    """Get runtime metrics (LLM latency and scheduling, executor replicas, admission, tracing)"""
+    return {
+        "llm_latency": get_llm_latency_stats(),
+        "llm_scheduler": llm_scheduler.stats(),
+        "code_extraction": get_extraction_stats(),
+        "preflight": get_preflight_stats(),
+        "code_executors": executor_pool.stats(),
+        "admission": admission.snapshot(),
+        "tracing": get_tracing_stats()
+    }
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run("main:app", host="0.0.0.0", port=8000, reload=True)
\ No newline at end of file
@@ -0,0 +1,31 @@
+# app/token_bucket.py
+"""
+Token bucket shared by inbound admission control (per-session and per-IP
+limits) and the outbound LLM scheduler (requests and tokens per minute).
+"""
+import time
+
+class TokenBucket:
+    """Classic token bucket refilled continuously at `rate` tokens per second"""
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def wait_time(self, tokens: float = 1) -> float:
+        """Seconds until `tokens` are available, without taking them"""
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= tokens:
+            return 0.0
+        return (tokens - self.tokens) / self.rate
+
+    def try_take(self, tokens: float = 1) -> float:
+        """Take tokens if available; otherwise return the seconds until they are"""
+        wait = self.wait_time(tokens)
+        if wait == 0:
+            self.tokens -= tokens
+        return wait
@@ -1,28 +1,168 @@
 # app/tools/code_executor.py
+import os
 import json
+import random
+import logging
+import threading
 import requests
-from typing import Dict, Any
-from langsmith import traceable
+from requests.adapters import HTTPAdapter
+from typing import Dict, Any, List, Optional
+from tracing import traced
 
-CODE_EXECUTOR_URL = "http://code-executor:8080/execute"
+logger = logging.getLogger("python-tutor-agent")
 
-@traceable(name="execute_code_in_container")
-def execute_code_in_container(code: str, timeout: int = 5) -> Dict[str, Any]:
+# Comma-separated list of executor base URLs, e.g.
+# "http://code-executor-1:8080,http://code-executor-2:8080"
+CODE_EXECUTOR_URLS = [
+    url.strip().rstrip("/")
+    for url in os.environ.get("CODE_EXECUTOR_URLS", "http://code-executor:8080").split(",")
+    if url.strip()
+]
+HEALTH_CHECK_INTERVAL = float(os.environ.get("CODE_EXECUTOR_HEALTH_INTERVAL", "5"))
+MAX_ATTEMPTS = int(os.environ.get("CODE_EXECUTOR_MAX_ATTEMPTS", "2"))
+# Keep-alive connections per replica; sized to the /chat in-flight cap so
+# concurrent requests don't open and drop extra connections
+POOL_SIZE = int(os.environ.get("CODE_EXECUTOR_POOL_SIZE", os.environ.get("CHAT_MAX_IN_FLIGHT", "16")))
+
+class ExecutorReplica:
+    """A single code-executor endpoint with its own pooled HTTP session"""
+
+    def __init__(self, base_url: str):
+        self.base_url = base_url
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=POOL_SIZE)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.outstanding = 0
+        self.healthy = True
+
+    def __repr__(self):
+        return f"ExecutorReplica({self.base_url}, outstanding={self.outstanding}, healthy={self.healthy})"
+
+class ExecutorPool:
+    """
+    Client-side load balancer over several code-executor replicas.
+
+    Replicas are picked with power-of-two-choices on the number of outstanding
+    requests. A background thread probes /health and ejects replicas that fail;
+    a failed call is retried once on another replica.
+    """
+
+    def __init__(self, urls: List[str], health_interval: float = HEALTH_CHECK_INTERVAL):
+        self.replicas = [ExecutorReplica(url) for url in urls]
+        self.health_interval = health_interval
+        self._lock = threading.Lock()
+        self._health_thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+
+    def start_health_checks(self):
+        """Start background /health probing (idempotent)"""
+        with self._lock:
+            if self._health_thread is not None or len(self.replicas) < 2:
+                return
+            self._health_thread = threading.Thread(target=self._health_loop, name="executor-health", daemon=True)
+            self._health_thread.start()
+
+    def stop(self):
+        """Stop background health probing"""
+        self._stop.set()
+
+    def _health_loop(self):
+        while not self._stop.wait(self.health_interval):
+            for replica in self.replicas:
+                self.probe(replica)
+
+    def probe(self, replica: ExecutorReplica) -> bool:
+        """Probe a replica's /health endpoint and update its status"""
+        try:
+            response = replica.session.get(f"{replica.base_url}/health", timeout=2)
+            healthy = response.status_code == 200
+        except requests.exceptions.RequestException:
+            healthy = False
+        if healthy != replica.healthy:
+            logger.info(f"Code executor {replica.base_url} is now {'healthy' if healthy else 'unhealthy'}")
+        replica.healthy = healthy
+        return healthy
+
+    def pick(self, exclude: Optional[List[ExecutorReplica]] = None) -> Optional[ExecutorReplica]:
+        """Pick a replica using power-of-two-choices on outstanding requests"""
+        exclude = exclude or []
+        with self._lock:
+            candidates = [r for r in self.replicas if r.healthy and r not in exclude]
+            if not candidates:
+                # Every replica is ejected: try the ones we have not used yet anyway
+                candidates = [r for r in self.replicas if r not in exclude]
+            if not candidates:
+                return None
+            if len(candidates) == 1:
+                chosen = candidates[0]
+            else:
+                first, second = random.sample(candidates, 2)
+                chosen = first if first.outstanding <= second.outstanding else second
+            chosen.outstanding += 1
+            return chosen
+
+    def release(self, replica: ExecutorReplica):
+        with self._lock:
+            replica.outstanding -= 1
+
+    def post(self, path: str, payload: Dict[str, Any], timeout: float) -> requests.Response:
+        """POST to a replica, retrying on another replica if the call fails"""
+        self.start_health_checks()
+        tried: List[ExecutorReplica] = []
+        last_error: Optional[Exception] = None
+        for _ in range(min(MAX_ATTEMPTS, len(self.replicas))):
+            replica = self.pick(exclude=tried)
+            if replica is None:
+                break
+            tried.append(replica)
+            try:
+                response = replica.session.post(f"{replica.base_url}{path}", json=payload, timeout=timeout)
+                if response.status_code < 500:
+                    return response
+                last_error = Exception(f"Code execution service error: {response.status_code}")
+            except requests.exceptions.Timeout:
+                # The snippet itself may be slow; don't run it a second time
+                raise
+            except requests.exceptions.RequestException as e:
+                last_error = e
+            finally:
+                self.release(replica)
+            replica.healthy = False
+            logger.error(f"Code executor {replica.base_url} failed, ejecting: {last_error}")
+        raise last_error or Exception("No code executor replica available")
+
+    def stats(self) -> List[Dict[str, Any]]:
+        """Return the current state of every replica"""
+        return [
+            {"url": r.base_url, "healthy": r.healthy, "outstanding": r.outstanding}
+            for r in self.replicas
+        ]
+
+executor_pool = ExecutorPool(CODE_EXECUTOR_URLS)
+
+@traced(name="execute_code_in_container")
+def execute_code_in_container(code: str, timeout: int = 5, profile: Optional[str] = None) -> Dict[str, Any]:
     """
     Execute Python code in a dedicated container and return the results.
     
     Args:
         code (str): Python code to execute
         timeout (int): Maximum execution time in seconds
+        profile (str): Optional profiling mode, "cprofile" or "lines"
         
     Returns:
         Dict with execution results
     """
+    payload = {"code": code, "timeout": timeout}
+    if profile:
+        payload["profile"] = profile
+
     try:
-        # Send code to the containerized execution service
-        response = requests.post(
-            CODE_EXECUTOR_URL,
-            json={"code": code, "timeout": timeout},
+        # Send code to one of the containerized execution services
+        response = executor_pool.post(
+            "/execute",
+            payload,
             timeout=timeout + 2  # Slightly longer timeout for the HTTP request
         )
         
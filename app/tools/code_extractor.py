@@ -0,0 +1,194 @@
+# app/tools/code_extractor.py
+"""
+Local extraction of Python code from free-form messages.
+
+Scans the message for inline `backtick` spans (alone and joined together) and
+for the largest line ranges (including indented blocks and code following a
+"prose:" prefix) that ast.parse accepts, scores each candidate and returns the
+best one with a confidence between 0 and 1. Code that starts like Python
+after a "prose:" prefix but does not parse is returned as-is, so the
+execute/fix loop can repair it. Callers fall back to the LLM only when the
+confidence is low.
+"""
+import re
+import ast
+import textwrap
+from typing import List, Optional, Tuple
+
+# Messages longer than this are only scanned from a limited number of start lines
+MAX_SCAN_LINES = 120
+# Longest block tried from each start line, and the ast.parse budget per message,
+# so long prose costs a bounded amount of CPU instead of growing cubically
+MAX_BLOCK_LINES = 60
+MAX_PARSE_ATTEMPTS = 1000
+CONFIDENCE_THRESHOLD = 0.6
+
+# Statements that only appear in real code. A bare annotation ("Run: sorted(x)")
+# is what a "prose:" prefix parses as, so it only counts with a value
+STRONG_NODES = (
+    ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef, ast.For, ast.AsyncFor,
+    ast.While, ast.If, ast.With, ast.AsyncWith, ast.Try, ast.Import, ast.ImportFrom,
+    ast.Assign, ast.AugAssign, ast.Return, ast.Delete, ast.Raise,
+    ast.Assert, ast.Global, ast.Nonlocal,
+)
+# Bare expressions that English words can also parse as ("hello", "None", "os.path")
+TRIVIAL_EXPRESSIONS = (ast.Name, ast.Constant, ast.Attribute)
+
+# Code that does not parse (e.g. "fix this code: for i in range(10) print(i)") is
+# still worth sending to the execute/fix loop when it clearly starts like Python
+STATEMENT_START_PATTERN = re.compile(
+    r"^(def|class|for|while|if|import|from|return|with|try|print\s*\(|[A-Za-z_]\w*\s*=[^=])"
+)
+BROKEN_CODE_CONFIDENCE = CONFIDENCE_THRESHOLD
+
+INLINE_CODE_PATTERN = re.compile(r"(?<!`)`([^`\n]+)`(?!`)")
+PROSE_PREFIX_PATTERN = re.compile(r"^[^`]*?:\s+(\S.*)$")
+
+def _parse(code: str) -> Optional[ast.Module]:
+    try:
+        return ast.parse(code)
+    except (SyntaxError, ValueError):
+        return None
+
+def _score(tree: ast.Module) -> Tuple[int, int]:
+    """Count strong statements and non-trivial expression statements"""
+    strong = weak = 0
+    for node in tree.body:
+        if isinstance(node, STRONG_NODES) or (isinstance(node, ast.AnnAssign) and node.value is not None):
+            strong += 1
+        elif isinstance(node, ast.Expr):
+            if isinstance(node.value, ast.Call):
+                strong += 1
+            elif not isinstance(node.value, TRIVIAL_EXPRESSIONS):
+                weak += 1
+    return strong, weak
+
+def _confidence(code: str, tree: ast.Module, message: str) -> float:
+    strong, weak = _score(tree)
+    if strong == 0 and weak == 0:
+        return 0.0
+    # How much of the message the candidate explains
+    coverage = len(re.sub(r"\s", "", code)) / max(1, len(re.sub(r"\s", "", message)))
+    confidence = 0.45 + 0.15 * min(strong, 3) + 0.05 * min(weak, 2) + 0.3 * coverage
+    # A lone expression is plausible but weak evidence on its own
+    if strong == 0:
+        confidence -= 0.2
+    return max(0.0, min(1.0, confidence))
+
+def _is_trivial(node: ast.stmt) -> bool:
+    return isinstance(node, ast.Expr) and isinstance(node.value, TRIVIAL_EXPRESSIONS)
+
+def _trim_trivial_tail(block: str, tree: ast.Module) -> str:
+    """Drop trailing bare names such as a closing "thanks" after the code"""
+    lines = block.splitlines()
+    body = list(tree.body)
+    while len(body) > 1 and _is_trivial(body[-1]):
+        lines = lines[:body[-1].lineno - 1]
+        body.pop()
+    return "\n".join(lines).strip()
+
+def _is_code_span(span: str) -> bool:
+    """An inline span that is code rather than a reference such as `x` or `None`"""
+    tree = _parse(span)
+    return tree is not None and not all(_is_trivial(node) for node in tree.body)
+
+def _is_bare_annotation(node: ast.stmt) -> bool:
+    return isinstance(node, ast.AnnAssign) and node.value is None
+
+def _is_print_call(node: ast.expr) -> bool:
+    return isinstance(node, ast.Call) and isinstance(node.func, ast.Name) and node.func.id == "print"
+
+def _as_executable(code: str, tree: ast.Module, interactive: bool) -> str:
+    """
+    Echo the value of a trailing expression the way the REPL does, so running a
+    lone expression (or inline snippets) shows the result: the value is printed
+    with repr() and only when it is not None, so x.append(4) prints nothing.
+    """
+    last = tree.body[-1]
+    if not (interactive or len(tree.body) == 1):
+        return code
+    if not isinstance(last, ast.Expr) or _is_print_call(last.value):
+        return code
+    lines = code.splitlines()
+    line = lines[last.lineno - 1]
+    lines[last.lineno - 1] = line[:last.col_offset] + "_ = " + line[last.col_offset:]
+    return "\n".join(lines + ["if _ is not None:", "    print(repr(_))"])
+
+def _line_range_candidates(lines: List[str]) -> List[str]:
+    """Largest parseable block starting at each line (or after a prose prefix)"""
+    candidates = []
+    scan_starts = min(len(lines), MAX_SCAN_LINES)
+    covered_until = -1
+    parse_budget = MAX_PARSE_ATTEMPTS
+    for start in range(scan_starts):
+        if start <= covered_until or not lines[start].strip():
+            continue
+        first_lines = [lines[start]]
+        prefix_match = PROSE_PREFIX_PATTERN.match(lines[start].strip())
+        if prefix_match:
+            first_lines.append(prefix_match.group(1))
+        for first_line in first_lines:
+            for end in range(min(len(lines), start + MAX_BLOCK_LINES), start, -1):
+                # A block ending in a blank line parses the same as the shorter one
+                if end - 1 > start and not lines[end - 1].strip():
+                    continue
+                if parse_budget <= 0:
+                    return candidates
+                parse_budget -= 1
+                block = textwrap.dedent("\n".join([first_line] + lines[start + 1:end])).strip()
+                tree = _parse(block) if block else None
+                if tree is not None:
+                    if first_line is lines[start]:
+                        # Lines inside this block would only yield smaller candidates
+                        covered_until = end - 1
+                        if prefix_match and _is_bare_annotation(tree.body[0]):
+                            # "Run: sorted(x)" is prose plus code: keep only the stripped candidate
+                            break
+                    candidates.append(_trim_trivial_tail(block, tree))
+                    break
+    return candidates
+
+def _broken_code_candidate(lines: List[str]) -> Optional[str]:
+    """Text after a "prose:" prefix that starts like a Python statement"""
+    for start, line in enumerate(lines[:MAX_SCAN_LINES]):
+        prefix_match = PROSE_PREFIX_PATTERN.match(line.strip())
+        if prefix_match and STATEMENT_START_PATTERN.match(prefix_match.group(1)):
+            return textwrap.dedent("\n".join([prefix_match.group(1)] + lines[start + 1:])).strip()
+    return None
+
+def extract_code(message: str) -> Tuple[Optional[str], float]:
+    """
+    Extract the most likely Python code from a message.
+
+    Args:
+        message (str): User message mixing prose and code
+
+    Returns:
+        Tuple of (code, confidence); code is None when nothing plausible is found
+    """
+    spans = [m.group(1).strip() for m in INLINE_CODE_PATTERN.finditer(message)]
+    # Snippets spread over a sentence ("`x = [1]` and then `x.append(2)`") run together;
+    # spans that only name something (`x`, `None`) are references, not code
+    code_spans = [span for span in spans if _is_code_span(span)]
+    if len(code_spans) > 1:
+        spans.append("\n".join(code_spans))
+    inline_count = len(spans)
+    candidates = spans + _line_range_candidates(message.splitlines())
+
+    best_code, best_confidence = None, 0.0
+    for index, candidate in enumerate(candidates):
+        tree = _parse(candidate)
+        if tree is None:
+            continue
+        confidence = _confidence(candidate, tree, message)
+        if index < inline_count:
+            # The user marked this as code explicitly
+            confidence = min(1.0, confidence + 0.2)
+        if confidence > best_confidence or (confidence == best_confidence and best_code and len(candidate) > len(best_code)):
+            best_code, best_confidence = _as_executable(candidate, tree, index < inline_count), confidence
+
+    if best_confidence < BROKEN_CODE_CONFIDENCE:
+        broken_code = _broken_code_candidate(message.splitlines())
+        if broken_code:
+            best_code, best_confidence = broken_code, BROKEN_CODE_CONFIDENCE
+    return best_code, best_confidence
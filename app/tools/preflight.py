@@ -0,0 +1,201 @@
+# app/tools/preflight.py
+"""
+Local checks run before sending code to the executor.
+
+- Syntax check with compile(), so syntax errors skip the executor round-trip
+- Static check for common standard-library modules used without an import
+  (e.g. math.sqrt without `import math`); the import is added locally on an
+  existing line, so traceback line numbers still match the student's code
+- A memoized fix cache keyed on (normalized code, normalized error), so
+  repeated student mistakes reuse an earlier fix instead of calling the LLM
+"""
+import re
+import ast
+import hashlib
+import threading
+import traceback
+from collections import OrderedDict
+from typing import Dict, Any, List, Optional, Tuple
+
+# Modules students commonly use without importing them
+COMMON_MODULES = {
+    "math", "random", "os", "sys", "re", "json", "time", "datetime", "collections",
+    "itertools", "functools", "statistics", "string", "decimal", "fractions",
+}
+FIX_CACHE_SIZE = 1024
+# Statements whose first line cannot take a "import x; " prefix
+COMPOUND_NODES = (
+    ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef, ast.If, ast.For, ast.AsyncFor,
+    ast.While, ast.With, ast.AsyncWith, ast.Try, ast.Match,
+) + ((ast.TryStar,) if hasattr(ast, "TryStar") else ())
+
+preflight_stats = {"checks": 0, "syntax_errors": 0, "missing_imports_fixed": 0}
+_stats_lock = threading.Lock()
+
+def check_syntax(code: str) -> Optional[str]:
+    """Compile the code locally; return a Python-style error message on failure"""
+    try:
+        compile(code, "<string>", "exec")
+        return None
+    except (SyntaxError, ValueError) as e:
+        return "".join(traceback.format_exception_only(type(e), e))
+
+def find_missing_imports(code: str) -> List[str]:
+    """Return common modules that are used as `module.attr` but never imported or defined"""
+    try:
+        tree = ast.parse(code)
+    except (SyntaxError, ValueError):
+        return []
+
+    defined = set()
+    used = set()
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Import):
+            defined.update((alias.asname or alias.name).split(".")[0] for alias in node.names)
+        elif isinstance(node, ast.ImportFrom):
+            defined.update(alias.asname or alias.name for alias in node.names)
+        elif isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+            defined.add(node.name)
+        elif isinstance(node, ast.arg):
+            defined.add(node.arg)
+        elif isinstance(node, ast.Name) and isinstance(node.ctx, ast.Store):
+            defined.add(node.id)
+        elif isinstance(node, ast.Attribute) and isinstance(node.value, ast.Name) and node.value.id in COMMON_MODULES:
+            used.add(node.value.id)
+    return sorted(used - defined)
+
+def _insert_at(line: str, col_offset: int, text: str) -> str:
+    """Insert text at an AST column offset (which counts UTF-8 bytes)"""
+    encoded = line.encode("utf-8")
+    return (encoded[:col_offset] + text.encode("utf-8") + encoded[col_offset:]).decode("utf-8")
+
+def add_missing_imports(code: str) -> Tuple[str, List[str]]:
+    """
+    Add imports for common modules the code uses without importing.
+
+    The imports share an existing line (after the docstring and __future__
+    imports) so line numbers in tracebacks still match the student's code.
+    """
+    missing = find_missing_imports(code)
+    if not missing:
+        return code, []
+    imports = "; ".join(f"import {module}" for module in missing)
+    tree = ast.parse(code)
+    lines = code.split("\n")
+
+    # The module docstring and __future__ imports must stay first
+    header = None
+    for index, node in enumerate(tree.body):
+        is_docstring = index == 0 and isinstance(node, ast.Expr) and isinstance(node.value, ast.Constant) \
+            and isinstance(node.value.value, str)
+        if not (is_docstring or (isinstance(node, ast.ImportFrom) and node.module == "__future__")):
+            break
+        header = node
+
+    if header is not None:
+        # '"""Docstring"""; import math'
+        lines[header.end_lineno - 1] = _insert_at(lines[header.end_lineno - 1], header.end_col_offset, f"; {imports}")
+        return "\n".join(lines), missing
+
+    first = tree.body[0]
+    if not isinstance(first, COMPOUND_NODES):
+        # 'import math; print(math.pi)'
+        lines[first.lineno - 1] = f"{imports}; {lines[first.lineno - 1]}"
+        return "\n".join(lines), missing
+    first_line = min([first.lineno] + [d.lineno for d in getattr(first, "decorator_list", [])])
+    for index in range(first_line - 1):
+        if not lines[index].strip() or lines[index].lstrip().startswith("#"):
+            # A blank or comment line before the code: 'import math;  # comment'
+            lines[index] = f"{imports}; {lines[index].lstrip()}".rstrip()
+            return "\n".join(lines), missing
+    # The code starts with a compound statement on line 1; one extra line is unavoidable
+    return f"{imports}\n{code}", missing
+
+def run_preflight(code: str) -> Tuple[str, List[str], Optional[str]]:
+    """
+    Run all local checks on code before execution.
+
+    Returns:
+        Tuple of (code with missing imports added, added modules, syntax error or None)
+    """
+    code, added_imports = add_missing_imports(code)
+    syntax_error = check_syntax(code)
+    with _stats_lock:
+        preflight_stats["checks"] += 1
+        if added_imports:
+            preflight_stats["missing_imports_fixed"] += 1
+        if syntax_error:
+            preflight_stats["syntax_errors"] += 1
+    return code, added_imports, syntax_error
+
+def normalize_code(code: str) -> str:
+    """Ignore trailing whitespace and blank lines"""
+    return "\n".join(line.rstrip() for line in code.strip().splitlines() if line.strip())
+
+def normalize_error(error: str) -> str:
+    """Drop file paths (temp files differ per run) and keep the meaningful lines"""
+    lines = []
+    for line in error.strip().splitlines():
+        line = re.sub(r'File "[^"]*"', 'File "<code>"', line).strip()
+        if line and not line.startswith("Traceback"):
+            lines.append(line)
+    return "\n".join(lines)
+
+class FixCache:
+    """LRU cache of code fixes keyed on (normalized code, normalized error)"""
+
+    def __init__(self, max_size: int = FIX_CACHE_SIZE):
+        self.max_size = max_size
+        self.entries: "OrderedDict[str, str]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        # /chat and /chat/batch run the graph in worker threads
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(code: str, error: str) -> str:
+        payload = f"{normalize_code(code)}\0{normalize_error(error)}"
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def get(self, code: str, error: str) -> Optional[str]:
+        key = self.key(code, error)
+        with self._lock:
+            fixed_code = self.entries.get(key)
+            if fixed_code is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return fixed_code
+
+    def put(self, code: str, error: str, fixed_code: str):
+        key = self.key(code, error)
+        with self._lock:
+            self.entries[key] = fixed_code
+            self.entries.move_to_end(key)
+            if len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "size": len(self.entries),
+                "hit_rate": self.hits / lookups if lookups else 0.0
+            }
+
+fix_cache = FixCache()
+
+def get_preflight_stats() -> Dict[str, Any]:
+    """Return pre-flight hit rates and fix cache statistics"""
+    with _stats_lock:
+        stats = dict(preflight_stats)
+    checks = stats["checks"]
+    return {
+        **stats,
+        "syntax_error_rate": stats["syntax_errors"] / checks if checks else 0.0,
+        "missing_import_rate": stats["missing_imports_fixed"] / checks if checks else 0.0,
+        "fix_cache": fix_cache.stats()
+    }
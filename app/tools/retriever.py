@@ -4,9 +4,9 @@ from langchain.schema import Document
 import os
 import chromadb
 from pathlib import Path
-from langsmith import traceable
+from tracing import traced
 
-@traceable(name="setup_chroma_retriever")
+@traced(name="setup_chroma_retriever")
 def setup_chroma_retriever():
     """Set up and return a Chroma retriever with Python knowledge"""
     # Initialize embeddings
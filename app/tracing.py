@@ -0,0 +1,291 @@
+# app/tracing.py
+"""
+Sampled, non-blocking tracing for the agent.
+
+Functions are decorated with @traced(name) instead of langsmith's @traceable.
+The sampling decision is taken once per trace (at the outermost traced call)
+and inherited by nested calls, so a request is either traced completely or
+not at all. main.chat and the batch runner wrap each graph run in a "chat"
+root span for this. Three modes, chosen with TRACING_MODE:
+
+    off       - no tracing
+    langsmith - sampled calls go through langsmith's @traceable; LangChain's
+                global auto-tracing stays off and is enabled only inside
+                sampled traces, so unsampled requests send nothing
+    local     - sampled calls record lightweight spans (name, timing, error,
+                no payloads) that a background thread writes in batches to a
+                JSONL file or, for a .db/.sqlite path, an SQLite database
+
+The local exporter uses a bounded queue and drops spans when it is full
+rather than blocking the request.
+
+Run `python tracing.py` to benchmark the per-request overhead of each mode.
+"""
+import os
+import json
+import time
+import uuid
+import queue
+import atexit
+import random
+import sqlite3
+import logging
+import functools
+import threading
+from contextvars import ContextVar
+from typing import Dict, Any, List, Optional, Callable
+
+logger = logging.getLogger("python-tutor-agent")
+
+TRACING_MODES = ("off", "langsmith", "local")
+
+config = {
+    "mode": os.environ.get("TRACING_MODE", "langsmith" if os.environ.get("LANGCHAIN_API_KEY") else "off"),
+    "sample_rate": float(os.environ.get("TRACE_SAMPLE_RATE", "0.1")),
+    "export_path": os.environ.get("TRACE_EXPORT_PATH", "/data/traces.jsonl"),
+    "queue_size": int(os.environ.get("TRACE_QUEUE_SIZE", "10000")),
+    "batch_size": int(os.environ.get("TRACE_BATCH_SIZE", "200")),
+    "flush_interval": float(os.environ.get("TRACE_FLUSH_INTERVAL", "2")),
+}
+
+# Sampling decision and current span for the trace being executed
+_sampled: ContextVar[Optional[bool]] = ContextVar("trace_sampled", default=None)
+_current_span: ContextVar[Optional[Dict[str, Any]]] = ContextVar("trace_span", default=None)
+
+# Marker used by the exporter loop when the flush interval elapses without new spans
+_FLUSH = object()
+
+class LocalTraceExporter:
+    """Writes spans to JSONL or SQLite from a background thread, in batches"""
+
+    def __init__(self, path: str, queue_size: int, batch_size: int, flush_interval: float):
+        self.path = path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.queue: "queue.Queue[Optional[Dict[str, Any]]]" = queue.Queue(maxsize=queue_size)
+        self.stats = {"exported": 0, "dropped": 0, "batches": 0}
+        self.use_sqlite = path.endswith((".db", ".sqlite", ".sqlite3"))
+        self._thread = threading.Thread(target=self._run, name="trace-exporter", daemon=True)
+        self._thread.start()
+
+    def submit(self, span: Dict[str, Any]):
+        """Queue a span for export, dropping it if the queue is full"""
+        try:
+            self.queue.put_nowait(span)
+        except queue.Full:
+            self.stats["dropped"] += 1
+
+    def close(self, timeout: float = 5):
+        """Flush queued spans and stop the exporter thread"""
+        try:
+            self.queue.put(None, timeout=timeout)
+        except queue.Full:
+            pass
+        self._thread.join(timeout)
+
+    def _run(self):
+        batch: List[Dict[str, Any]] = []
+        deadline = time.monotonic() + self.flush_interval
+        while True:
+            try:
+                span = self.queue.get(timeout=max(0.0, deadline - time.monotonic()))
+            except queue.Empty:
+                span = _FLUSH
+            if span is None:
+                self._write(batch)
+                return
+            if span is not _FLUSH:
+                batch.append(span)
+            if len(batch) >= self.batch_size or time.monotonic() >= deadline:
+                self._write(batch)
+                batch = []
+                deadline = time.monotonic() + self.flush_interval
+
+    def _write(self, batch: List[Dict[str, Any]]):
+        if not batch:
+            return
+        try:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            if self.use_sqlite:
+                self._write_sqlite(batch)
+            else:
+                with open(self.path, "a", encoding="utf-8") as f:
+                    f.writelines(json.dumps(span) + "\n" for span in batch)
+            self.stats["exported"] += len(batch)
+            self.stats["batches"] += 1
+        except Exception as e:
+            self.stats["dropped"] += len(batch)
+            logger.error(f"Failed to export {len(batch)} spans: {e}")
+
+    def _write_sqlite(self, batch: List[Dict[str, Any]]):
+        with sqlite3.connect(self.path) as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS spans (trace_id TEXT, span_id TEXT, parent_id TEXT, "
+                "name TEXT, start REAL, duration_ms REAL, error TEXT)"
+            )
+            conn.executemany(
+                "INSERT INTO spans VALUES (:trace_id, :span_id, :parent_id, :name, :start, :duration_ms, :error)",
+                batch
+            )
+
+_exporter: Optional[LocalTraceExporter] = None
+_exporter_lock = threading.Lock()
+
+def get_exporter() -> LocalTraceExporter:
+    """Return the local exporter, starting it on first use"""
+    global _exporter
+    if _exporter is None:
+        with _exporter_lock:
+            if _exporter is None:
+                _exporter = LocalTraceExporter(
+                    config["export_path"], config["queue_size"], config["batch_size"], config["flush_interval"]
+                )
+                atexit.register(_exporter.close)
+    return _exporter
+
+def configure(mode: Optional[str] = None, sample_rate: Optional[float] = None, export_path: Optional[str] = None):
+    """Set the tracing mode, sample rate and local export path"""
+    global _exporter
+    if mode is not None:
+        if mode not in TRACING_MODES:
+            raise ValueError(f"Unknown tracing mode: {mode}")
+        config["mode"] = mode
+    if sample_rate is not None:
+        config["sample_rate"] = sample_rate
+    if export_path is not None and export_path != config["export_path"]:
+        config["export_path"] = export_path
+        if _exporter is not None:
+            _exporter.close()
+            _exporter = None
+    # LangChain's own auto-tracing would send every run regardless of sampling;
+    # in langsmith mode it is enabled per sampled trace by traced() instead
+    os.environ["LANGCHAIN_TRACING_V2"] = "false"
+    if config["mode"] == "langsmith":
+        os.environ.setdefault("LANGCHAIN_PROJECT", "python-tutor-agent")
+        os.environ.setdefault("LANGCHAIN_ENDPOINT", "https://api.smith.langchain.com")
+
+def get_tracing_stats() -> Dict[str, Any]:
+    """Return the tracing configuration and exporter counters"""
+    stats = {"mode": config["mode"], "sample_rate": config["sample_rate"]}
+    if _exporter is not None:
+        stats["exporter"] = dict(_exporter.stats, queued=_exporter.queue.qsize(), path=_exporter.path)
+    return stats
+
+def _run_local_span(name: str, func: Callable, args, kwargs):
+    parent = _current_span.get()
+    span = {
+        "trace_id": parent["trace_id"] if parent else uuid.uuid4().hex,
+        "span_id": uuid.uuid4().hex[:16],
+        "parent_id": parent["span_id"] if parent else None,
+        "name": name,
+        "start": time.time(),
+        "duration_ms": 0.0,
+        "error": None,
+    }
+    token = _current_span.set(span)
+    start = time.perf_counter()
+    try:
+        return func(*args, **kwargs)
+    except Exception as e:
+        span["error"] = f"{type(e).__name__}: {e}"
+        raise
+    finally:
+        span["duration_ms"] = round((time.perf_counter() - start) * 1000, 3)
+        _current_span.reset(token)
+        get_exporter().submit(span)
+
+def traced(name: str):
+    """Decorator tracing a function according to the configured mode and sample rate"""
+    def decorator(func: Callable) -> Callable:
+        langsmith_func = None
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            nonlocal langsmith_func
+            mode = config["mode"]
+            if mode == "off":
+                return func(*args, **kwargs)
+
+            sampled = _sampled.get()
+            token = None
+            if sampled is None:
+                # Outermost traced call: decide for the whole trace
+                sampled = random.random() < config["sample_rate"]
+                token = _sampled.set(sampled)
+            try:
+                if mode == "langsmith":
+                    if sampled and langsmith_func is None:
+                        from langsmith import traceable
+                        langsmith_func = traceable(name=name)(func)
+                    run = langsmith_func if sampled else func
+                    if token is not None:
+                        # Root of the trace: switch LangChain/LangGraph tracing on or off for all of it
+                        from langsmith import tracing_context
+                        with tracing_context(enabled=sampled):
+                            return run(*args, **kwargs)
+                    return run(*args, **kwargs)
+                if not sampled:
+                    return func(*args, **kwargs)
+                return _run_local_span(name, func, args, kwargs)
+            finally:
+                if token is not None:
+                    _sampled.reset(token)
+        return wrapper
+    return decorator
+
+configure()
+
+if __name__ == "__main__":
+    import tempfile
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Benchmark per-request tracing overhead for each mode")
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--sample-rate", type=float, default=0.1)
+    parser.add_argument("--langsmith", action="store_true", help="Also benchmark langsmith mode (needs LANGCHAIN_API_KEY)")
+    args = parser.parse_args()
+
+    # A request shaped like a /chat turn: a "chat" root span (as in main.chat and
+    # batch.run_single_turn) around graph nodes calling a tool, over a large state
+    state = {"messages": [{"role": "user", "content": "x" * 2000}] * 20, "context": {"docs": ["y" * 1000] * 10}}
+
+    @traced("tool")
+    def tool(s):
+        return len(s["messages"])
+
+    @traced("node")
+    def node(s):
+        return tool(s) + tool(s)
+
+    @traced("chat")
+    def chat(s):
+        return node(s) + node(s)
+
+    def bench() -> float:
+        start = time.perf_counter()
+        for _ in range(args.requests):
+            chat(state)
+        return (time.perf_counter() - start) / args.requests * 1e6
+
+    with tempfile.TemporaryDirectory() as tmp:
+        runs = [("off", 0.0, None)]
+        for path in ("traces.jsonl", "traces.db"):
+            runs.append(("local", 1.0, os.path.join(tmp, path)))
+            runs.append(("local", args.sample_rate, os.path.join(tmp, path)))
+        if args.langsmith:
+            runs += [("langsmith", 1.0, None), ("langsmith", args.sample_rate, None)]
+
+        baseline = None
+        for mode, rate, path in runs:
+            configure(mode=mode, sample_rate=rate, export_path=path)
+            per_request = bench()
+            baseline = per_request if baseline is None else baseline
+            label = f"{mode} ({os.path.basename(path)})" if path else mode
+            print(f"{label:24} sample_rate={rate:<5} {per_request:8.1f} us/request "
+                  f"(+{per_request - baseline:.1f} us)")
+            if _exporter is not None:
+                _exporter.close()
+                print(f"{'':24} exporter: {_exporter.stats}")
+                _exporter = None
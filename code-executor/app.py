@@ -1,40 +1,58 @@
 # code-executor/app.py
 from fastapi import FastAPI, HTTPException
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 import subprocess
 import tempfile
 import os
 import signal
+import json
 import time
 from typing import Dict, Any, Optional
 
 app = FastAPI(title="Code Execution Sandbox")
 
+PROFILER_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "profiler.py")
+PROFILE_MODES = ("cprofile", "lines")
+# How long a timed-out run gets after SIGTERM to write its partial profile
+KILL_GRACE_SECONDS = 1.0
+
 class CodeRequest(BaseModel):
     code: str
     timeout: Optional[int] = 5  # Default timeout in seconds
+    profile: Optional[str] = None  # "cprofile" (hot functions + memory) or "lines" (line timing)
+    top_n: int = Field(10, ge=1, le=50)  # Number of functions/allocation sites/lines to report
 
 class CodeResponse(BaseModel):
     output: str
     success: bool
     error: Optional[str] = None
     execution_time: float
+    profile: Optional[Dict[str, Any]] = None
 
 @app.post("/execute", response_model=CodeResponse)
 async def execute_code(request: CodeRequest) -> Dict[str, Any]:
     """Execute provided code in a sandboxed environment"""
+    if request.profile is not None and request.profile not in PROFILE_MODES:
+        raise HTTPException(status_code=400, detail=f"Unknown profile mode: {request.profile}")
     
     # Create a temporary file for the code
     with tempfile.NamedTemporaryFile(suffix=".py", delete=False, dir="/tmp/executions") as temp_file:
         temp_file.write(request.code.encode('utf-8'))
         temp_file_path = temp_file.name
+    report_path = f"{temp_file_path}.profile.json"
+    
+    if request.profile:
+        # Run the code under the profiling harness, which writes a JSON report
+        command = ["python", PROFILER_PATH, request.profile, str(request.top_n), report_path, temp_file_path]
+    else:
+        command = ["python", temp_file_path]
     
     try:
         start_time = time.time()
         
         # Run the code in a subprocess with restricted permissions
         process = subprocess.Popen(
-            ["python", temp_file_path],
+            command,
             stdout=subprocess.PIPE,
             stderr=subprocess.PIPE,
             text=True,
@@ -45,30 +63,39 @@ async def execute_code(request: CodeRequest) -> Dict[str, Any]:
             # Wait for completion with timeout
             stdout, stderr = process.communicate(timeout=request.timeout)
             execution_time = time.time() - start_time
+            profile = read_profile_report(report_path) if request.profile else None
             
             if process.returncode == 0:
                 return {
                     "output": stdout,
                     "success": True,
-                    "execution_time": execution_time
+                    "execution_time": execution_time,
+                    "profile": profile
                 }
             else:
                 return {
                     "output": "",
                     "success": False,
                     "error": stderr,
-                    "execution_time": execution_time
+                    "execution_time": execution_time,
+                    "profile": profile
                 }
                 
         except subprocess.TimeoutExpired:
             # Kill the process group if timeout occurs
             os.killpg(os.getpgid(process.pid), signal.SIGTERM)
-            process.kill()
+            try:
+                # The profiling harness stops the script and writes what it measured so far
+                process.communicate(timeout=KILL_GRACE_SECONDS)
+            except subprocess.TimeoutExpired:
+                process.kill()
+                process.communicate()
             return {
                 "output": "",
                 "success": False,
                 "error": f"Execution timed out after {request.timeout} seconds",
-                "execution_time": request.timeout
+                "execution_time": request.timeout,
+                "profile": read_profile_report(report_path) if request.profile else None
             }
             
     except Exception as e:
@@ -80,9 +107,18 @@ async def execute_code(request: CodeRequest) -> Dict[str, Any]:
         }
         
     finally:
-        # Clean up temporary file
-        if os.path.exists(temp_file_path):
-            os.unlink(temp_file_path)
+        # Clean up temporary files
+        for path in (temp_file_path, report_path):
+            if os.path.exists(path):
+                os.unlink(path)
+
+def read_profile_report(report_path: str) -> Optional[Dict[str, Any]]:
+    """Load the JSON report written by the profiling harness, if any"""
+    try:
+        with open(report_path, encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
 
 @app.get("/health")
 async def health_check():
@@ -0,0 +1,206 @@
+# code-executor/profiler.py
+"""
+Profiling harness for student code.
+
+Usage: python profiler.py <mode> <top_n> <report_path> <script_path>
+
+Runs the script in-process under the requested profiler and writes a JSON
+report to report_path. The script's own stdout/stderr are left untouched so
+the sandbox can return them as usual. When the sandbox stops the script with
+SIGTERM at its timeout, the report covers the run so far and is marked
+"timed_out".
+
+Modes:
+    cprofile - cProfile hot functions plus tracemalloc allocation sites
+               (memory tracing runs at the same time and slows allocation-heavy
+               code, so timings are inflated relative to a plain run)
+    lines    - per-line hit counts and wall time (small snippets only)
+"""
+import os
+import sys
+import json
+import time
+import signal
+import pstats
+import cProfile
+import traceback
+import tracemalloc
+from typing import Dict, Any, Tuple
+
+MAX_LINE_PROFILE_LINES = 200
+STUDENT_FILE = "<student code>"
+# cProfile entries produced by the harness itself rather than the student code
+HARNESS_ENTRIES = {
+    "<built-in method builtins.exec>",
+    "<method 'disable' of '_lsprof.Profiler' objects>",
+}
+# Set by the SIGTERM handler; the script is only interrupted while it runs,
+# so a late signal cannot stop the report from being written
+timed_out = False
+script_running = False
+
+class ScriptTimeout(BaseException):
+    """Raised inside the student code when the sandbox stops it at the timeout"""
+
+def _stop_script(signum, frame):
+    global timed_out
+    timed_out = True
+    if script_running:
+        raise ScriptTimeout()
+
+def _display_name(filename: str, script_path: str) -> str:
+    if filename == script_path:
+        return STUDENT_FILE
+    return filename
+
+def _run_script(code, script_path: str) -> bool:
+    """Execute compiled student code as __main__; return False if it raised"""
+    global script_running
+    namespace = {"__name__": "__main__", "__file__": script_path}
+    script_running = True
+    try:
+        exec(code, namespace)
+        return True
+    except SystemExit as e:
+        return e.code in (None, 0)
+    except ScriptTimeout:
+        return False
+    except BaseException:
+        # Hide the harness frame so the traceback matches a plain `python script.py`
+        exc_type, exc, tb = sys.exc_info()
+        traceback.print_exception(exc_type, exc, tb.tb_next)
+        return False
+    finally:
+        script_running = False
+
+def profile_functions(code, script_path: str, top_n: int) -> Tuple[Dict[str, Any], bool]:
+    """Run under cProfile and tracemalloc, return hot functions and allocation sites"""
+    profiler = cProfile.Profile()
+    tracemalloc.start()
+    start_time = time.perf_counter()
+    profiler.enable()
+    success = _run_script(code, script_path)
+    profiler.disable()
+    total_time = time.perf_counter() - start_time
+    snapshot = tracemalloc.take_snapshot()
+    current_bytes, peak_bytes = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    stats = pstats.Stats(profiler)
+    functions = []
+    for (filename, line, name), (primitive_calls, calls, own_time, cumulative_time, _) in stats.stats.items():
+        if filename == __file__ or name in HARNESS_ENTRIES:
+            continue
+        functions.append({
+            "function": name,
+            "file": _display_name(filename, script_path),
+            "line": line,
+            "calls": calls,
+            "primitive_calls": primitive_calls,
+            "total_time": round(own_time, 6),
+            "cumulative_time": round(cumulative_time, 6)
+        })
+    functions.sort(key=lambda f: f["cumulative_time"], reverse=True)
+
+    snapshot = snapshot.filter_traces([tracemalloc.Filter(False, tracemalloc.__file__),
+                                       tracemalloc.Filter(False, __file__)])
+    allocations = [
+        {
+            "file": _display_name(stat.traceback[0].filename, script_path),
+            "line": stat.traceback[0].lineno,
+            "size_bytes": stat.size,
+            "count": stat.count
+        }
+        for stat in snapshot.statistics("lineno")[:top_n]
+    ]
+
+    report = {
+        "mode": "cprofile",
+        "total_time": round(total_time, 6),
+        "functions": functions[:top_n],
+        "memory": {
+            "peak_bytes": peak_bytes,
+            "current_bytes": current_bytes,
+            "allocation_sites": allocations
+        }
+    }
+    return report, success
+
+def profile_lines(code, script_path: str, source_lines, top_n: int) -> Tuple[Dict[str, Any], bool]:
+    """Run under a line tracer, return per-line hit counts and wall time"""
+    hits: Dict[int, int] = {}
+    times: Dict[int, float] = {}
+    last = {"line": None, "time": 0.0}
+
+    def tracer(frame, event, arg):
+        if frame.f_code.co_filename != script_path:
+            return None
+        if event == "line":
+            now = time.perf_counter()
+            if last["line"] is not None:
+                times[last["line"]] = times.get(last["line"], 0.0) + now - last["time"]
+            hits[frame.f_lineno] = hits.get(frame.f_lineno, 0) + 1
+            last["line"], last["time"] = frame.f_lineno, now
+        return tracer
+
+    start_time = time.perf_counter()
+    sys.settrace(tracer)
+    try:
+        success = _run_script(code, script_path)
+    finally:
+        sys.settrace(None)
+    end_time = time.perf_counter()
+    if last["line"] is not None:
+        times[last["line"]] = times.get(last["line"], 0.0) + end_time - last["time"]
+
+    lines = [
+        {
+            "line": lineno,
+            "source": source_lines[lineno - 1].rstrip() if lineno <= len(source_lines) else "",
+            "hits": hits[lineno],
+            "time": round(times.get(lineno, 0.0), 6)
+        }
+        for lineno in sorted(hits)
+    ]
+    hottest = sorted(lines, key=lambda l: l["time"], reverse=True)[:top_n]
+    report = {
+        "mode": "lines",
+        "total_time": round(end_time - start_time, 6),
+        "lines": lines,
+        "hottest_lines": [l["line"] for l in hottest]
+    }
+    return report, success
+
+def main():
+    mode, top_n, report_path, script_path = sys.argv[1], int(sys.argv[2]), sys.argv[3], sys.argv[4]
+    with open(script_path, encoding="utf-8") as f:
+        source = f.read()
+    # Make the script look like it was run directly
+    sys.argv = [script_path]
+    sys.path[0] = os.path.dirname(script_path)
+
+    try:
+        code = compile(source, script_path, "exec")
+    except SyntaxError:
+        traceback.print_exc()
+        sys.exit(1)
+
+    signal.signal(signal.SIGTERM, _stop_script)
+    source_lines = source.splitlines()
+    if mode == "lines" and len(source_lines) > MAX_LINE_PROFILE_LINES:
+        report = {"mode": "lines", "error": f"Line timing is limited to {MAX_LINE_PROFILE_LINES} lines"}
+        success = _run_script(code, script_path)
+    elif mode == "lines":
+        report, success = profile_lines(code, script_path, source_lines, top_n)
+    else:
+        report, success = profile_functions(code, script_path, top_n)
+    if timed_out:
+        report["timed_out"] = True
+
+    sys.stdout.flush()
+    with open(report_path, "w", encoding="utf-8") as f:
+        json.dump(report, f)
+    sys.exit(0 if success else 1)
+
+if __name__ == "__main__":
+    main()
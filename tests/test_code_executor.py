@@ -0,0 +1,104 @@
+# tests/test_code_executor.py
+"""Load spread and failover of the code-executor pool against local fake executors"""
+import json
+import threading
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import pytest
+from tools.code_executor import ExecutorPool
+
+class FakeExecutor:
+    """A local HTTP server answering /health and /execute like the code-executor service"""
+
+    def __init__(self, name: str):
+        self.name = name
+        self.requests = 0
+        executor = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def _reply(self, status: int, body: dict):
+                data = json.dumps(body).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def do_GET(self):
+                self._reply(200, {"status": "healthy"})
+
+            def do_POST(self):
+                self.rfile.read(int(self.headers["Content-Length"]))
+                executor.requests += 1
+                self._reply(200, {"output": executor.name, "success": True, "error": None, "execution_time": 0})
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}"
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+@pytest.fixture
+def executors():
+    fakes = [FakeExecutor(f"executor-{i}") for i in range(3)]
+    yield fakes
+    for fake in fakes:
+        fake.stop()
+
+def dead_url() -> str:
+    """URL of a port nothing listens on"""
+    server = ThreadingHTTPServer(("127.0.0.1", 0), BaseHTTPRequestHandler)
+    url = f"http://127.0.0.1:{server.server_address[1]}"
+    server.server_close()
+    return url
+
+def run(pool: ExecutorPool, count: int) -> Counter:
+    served = Counter()
+    for _ in range(count):
+        response = pool.post("/execute", {"code": "print(1)", "timeout": 5}, timeout=5)
+        served[response.json()["output"]] += 1
+    return served
+
+def test_load_is_spread_across_replicas(executors):
+    pool = ExecutorPool([fake.url for fake in executors], health_interval=60)
+    try:
+        served = run(pool, 60)
+    finally:
+        pool.stop()
+    assert sum(served.values()) == 60
+    assert len(served) == 3
+    assert min(served.values()) >= 10
+    assert all(replica["outstanding"] == 0 for replica in pool.stats())
+
+def test_failed_replica_is_ejected_and_retried(executors):
+    pool = ExecutorPool([dead_url()] + [fake.url for fake in executors], health_interval=60)
+    try:
+        served = run(pool, 30)
+    finally:
+        pool.stop()
+    # Every call succeeds, the dead replica is ejected and gets no more traffic
+    assert sum(served.values()) == 30
+    assert [replica["healthy"] for replica in pool.stats()] == [False, True, True, True]
+
+def test_health_check_restores_replica(executors):
+    pool = ExecutorPool([fake.url for fake in executors], health_interval=60)
+    try:
+        replica = pool.replicas[0]
+        replica.healthy = False
+        assert pool.probe(replica)
+        assert replica.healthy
+    finally:
+        pool.stop()
+
+def test_all_replicas_down_raises():
+    pool = ExecutorPool([dead_url(), dead_url()], health_interval=60)
+    try:
+        with pytest.raises(Exception):
+            pool.post("/execute", {"code": "print(1)", "timeout": 5}, timeout=5)
+    finally:
+        pool.stop()
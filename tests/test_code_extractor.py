@@ -0,0 +1,35 @@
+# tests/test_code_extractor.py
+"""Local code extraction from free-form messages"""
+import time
+from tools.code_extractor import extract_code, CONFIDENCE_THRESHOLD
+
+ECHO = "\nif _ is not None:\n    print(repr(_))"
+
+def test_lone_call_is_echoed():
+    code, confidence = extract_code("please run `sorted([3, 1, 2])`")
+    assert code == "_ = sorted([3, 1, 2])" + ECHO
+    assert confidence >= CONFIDENCE_THRESHOLD
+
+def test_prose_prefix_is_not_an_annotation():
+    code, _ = extract_code("Run: sorted([3, 1, 2])")
+    assert code == "_ = sorted([3, 1, 2])" + ECHO
+
+def test_inline_spans_are_joined():
+    code, _ = extract_code("I wrote `x = [1,2,3]` and then `x.append(4)`, but `x` looks wrong")
+    assert code == "x = [1,2,3]\n_ = x.append(4)" + ECHO
+
+def test_print_call_is_not_wrapped():
+    code, _ = extract_code("run `print(5)`")
+    assert code == "print(5)"
+
+def test_block_after_prose_prefix():
+    code, confidence = extract_code("can you run this:\nfor i in range(3):\n    print(i)\nthanks")
+    assert code == "for i in range(3):\n    print(i)"
+    assert confidence >= CONFIDENCE_THRESHOLD
+
+def test_long_prose_is_bounded():
+    line = "Please run this analysis of the report, which we discussed in the meeting yesterday (really)."
+    start = time.perf_counter()
+    code, _ = extract_code("\n".join([line] * 400))
+    assert code is None
+    assert time.perf_counter() - start < 1.0
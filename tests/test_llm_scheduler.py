@@ -0,0 +1,153 @@
+# tests/test_llm_scheduler.py
+"""Outbound LLM scheduling against a local fake LiteLLM that enforces quotas"""
+import json
+import time
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import pytest
+from deadline import DeadlineExceeded
+from llm_scheduler import LLMScheduler, ModelLane, PRIORITY_RESPOND, PRIORITY_AUXILIARY
+
+class FakeLiteLLM:
+    """
+    Chat completions endpoint with a concurrency quota. Requests over the quota,
+    or sent while a previous 429 is still in effect, get 429 with Retry-After.
+    """
+
+    def __init__(self, max_concurrent: int = 2, latency: float = 0.05, retry_after: float = 0.5):
+        self.max_concurrent = max_concurrent
+        self.latency = latency
+        self.retry_after = retry_after
+        self.concurrent = 0
+        self.blocked_until = 0.0
+        self.served: list = []
+        self.rejected: list = []
+        self.lock = threading.Lock()
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def do_POST(self):
+                body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+                with fake.lock:
+                    now = time.monotonic()
+                    limited = fake.concurrent >= fake.max_concurrent or now < fake.blocked_until
+                    if limited:
+                        fake.blocked_until = max(fake.blocked_until, now + fake.retry_after)
+                        fake.rejected.append(now)
+                    else:
+                        fake.concurrent += 1
+                if limited:
+                    self._reply(429, {"error": "rate limited"}, {"Retry-After": str(fake.retry_after)})
+                    return
+                time.sleep(fake.latency)
+                with fake.lock:
+                    fake.concurrent -= 1
+                    fake.served.append((time.monotonic(), body["messages"][0]["content"]))
+                self._reply(200, {"choices": [{"message": {"content": body["messages"][0]["content"]}}]})
+
+            def _reply(self, status, body, headers=None):
+                data = json.dumps(body).encode()
+                self.send_response(status)
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}/v1/chat/completions"
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+@pytest.fixture
+def litellm():
+    fake = FakeLiteLLM()
+    yield fake
+    fake.stop()
+
+def complete(scheduler, url, content, priority=PRIORITY_AUXILIARY, deadline=None):
+    payload = {"model": "tutor-fast", "messages": [{"role": "user", "content": content}]}
+    return scheduler.chat_completion(url, payload, priority, 100, timeout=10, deadline=deadline)
+
+def run_concurrently(calls):
+    results, errors = [], []
+    def run(call):
+        try:
+            results.append(call())
+        except Exception as e:
+            errors.append(e)
+    threads = [threading.Thread(target=run, args=(call,)) for call in calls]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return results, errors
+
+def test_in_flight_cap_avoids_429s(litellm):
+    scheduler = LLMScheduler(max_in_flight=2)
+    results, errors = run_concurrently([lambda i=i: complete(scheduler, litellm.url, f"q{i}") for i in range(12)])
+    assert errors == []
+    assert sorted(results) == sorted(f"q{i}" for i in range(12))
+    assert litellm.rejected == []
+    assert scheduler.stats()["tutor-fast"]["max_queue_seconds"] > 0
+
+def test_retry_after_pauses_the_whole_lane(litellm):
+    # The scheduler allows more than the provider does, so the first burst hits a 429
+    scheduler = LLMScheduler(max_in_flight=3)
+    results, errors = run_concurrently([lambda i=i: complete(scheduler, litellm.url, f"q{i}") for i in range(6)])
+    assert errors == []
+    assert len(results) == 6
+    first_429 = litellm.rejected[0]
+    # Nothing is sent while the Retry-After is in effect, so there is no 429 storm
+    assert all(at >= first_429 + litellm.retry_after for at in litellm.rejected[1:])
+    assert len(litellm.rejected) <= 2
+    assert scheduler.stats()["tutor-fast"]["rate_limited"] == len(litellm.rejected)
+
+def test_final_answer_goes_before_auxiliary_calls(litellm):
+    litellm.latency = 0.1
+    scheduler = LLMScheduler(max_in_flight=1)
+    calls = [lambda i=i: complete(scheduler, litellm.url, f"aux{i}") for i in range(4)]
+    threads = [threading.Thread(target=call) for call in calls]
+    for t in threads:
+        t.start()
+        time.sleep(0.01)
+    respond = threading.Thread(target=lambda: complete(scheduler, litellm.url, "respond", PRIORITY_RESPOND))
+    respond.start()
+    for t in threads + [respond]:
+        t.join()
+    order = [content for _, content in sorted(litellm.served)]
+    # Only the auxiliary call already in flight finishes before the final answer
+    assert order.index("respond") == 1
+
+def test_slot_wait_is_bounded_by_the_deadline(litellm):
+    scheduler = LLMScheduler(max_in_flight=1)
+    scheduler.backoff("tutor-fast", 30)
+    start = time.monotonic()
+    with pytest.raises(DeadlineExceeded):
+        complete(scheduler, litellm.url, "late", deadline=time.time() + 1.5)
+    assert time.monotonic() - start < 2
+    assert litellm.served == []
+
+def test_tokens_per_minute_budget_is_enforced():
+    lane = ModelLane("m", max_in_flight=10, requests_per_minute=6000, tokens_per_minute=6000)
+    for _ in range(2):
+        lane.acquire(PRIORITY_AUXILIARY, 2500, timeout=0.1)
+        lane.release()
+    # 5000 of the 6000 tokens are used; the next 2500-token call has to wait
+    with pytest.raises(DeadlineExceeded):
+        lane.acquire(PRIORITY_AUXILIARY, 2500, timeout=0.2)
+
+def test_oversized_request_is_charged_in_full():
+    lane = ModelLane("m", max_in_flight=10, requests_per_minute=6000, tokens_per_minute=6000)
+    lane.acquire(PRIORITY_AUXILIARY, 10000, timeout=0.1)
+    lane.release()
+    assert lane.token_bucket.tokens < 0
+    with pytest.raises(DeadlineExceeded):
+        lane.acquire(PRIORITY_AUXILIARY, 10, timeout=0.2)
@@ -0,0 +1,45 @@
+# tests/test_preflight.py
+"""Local pre-flight checks and the fix cache"""
+import threading
+from tools.preflight import run_preflight, add_missing_imports, FixCache
+
+def test_imports_keep_line_numbers():
+    code, added = add_missing_imports("x = 2\nprint(math.sqrt(x))\nprint(random.random())")
+    assert added == ["math", "random"]
+    assert code == "import math; import random; x = 2\nprint(math.sqrt(x))\nprint(random.random())"
+
+def test_imports_follow_future_imports_and_docstring():
+    code, added, syntax_error = run_preflight('"""Demo"""\nfrom __future__ import annotations\nprint(math.pi)')
+    assert added == ["math"]
+    assert syntax_error is None
+    assert code == '"""Demo"""\nfrom __future__ import annotations; import math\nprint(math.pi)'
+
+def test_imports_before_compound_statement_use_a_comment_line():
+    code, _ = add_missing_imports("# area\ndef area(r):\n    return math.pi * r ** 2\nprint(area(2))")
+    assert code == "import math; # area\ndef area(r):\n    return math.pi * r ** 2\nprint(area(2))"
+    assert run_preflight(code)[2] is None
+
+def test_syntax_error_is_reported_locally():
+    _, _, syntax_error = run_preflight("if True\n    print(1)")
+    assert "SyntaxError" in syntax_error
+
+def test_fix_cache_ignores_paths_and_is_thread_safe():
+    cache = FixCache(max_size=8)
+    cache.put("print(x)", 'File "/tmp/a.py", line 1\nNameError: x', "x = 1\nprint(x)")
+    assert cache.get("print(x)  \n", 'File "/tmp/b.py", line 1\nNameError: x') == "x = 1\nprint(x)"
+
+    errors = []
+    def worker(n):
+        try:
+            for i in range(2000):
+                cache.put(f"code {n} {i % 20}", "error", "fixed")
+                cache.get(f"code {(n + 1) % 4} {i % 20}", "error")
+        except Exception as e:
+            errors.append(e)
+    threads = [threading.Thread(target=worker, args=(n,)) for n in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert errors == []
+    assert cache.stats()["size"] <= 8
@@ -0,0 +1,62 @@
+# tests/test_tracing.py
+"""Per-trace sampling of the traced() decorator"""
+import os
+import json
+from collections import defaultdict
+import pytest
+import tracing
+from tracing import traced
+
+@traced("route_query")
+def route(state):
+    return state
+
+@traced("execute_code")
+def execute(state):
+    return state
+
+@traced("chat")
+def chat(state):
+    # Same shape as invoke_agent: graph nodes run under a "chat" root span
+    return execute(route(state))
+
+@pytest.fixture
+def local_tracing(tmp_path):
+    path = str(tmp_path / "traces.jsonl")
+    previous = dict(tracing.config)
+    tracing.configure(mode="local", sample_rate=0.5, export_path=path)
+    yield path
+    tracing.get_exporter().close()
+    tracing._exporter = None
+    tracing.config.update(previous)
+    tracing.configure()
+
+def test_requests_are_traced_completely_or_not_at_all(local_tracing):
+    for _ in range(200):
+        chat({})
+    tracing.get_exporter().close()
+    with open(local_tracing) as f:
+        spans = [json.loads(line) for line in f]
+
+    traces = defaultdict(list)
+    for span in spans:
+        traces[span["trace_id"]].append(span["name"])
+    assert 0 < len(traces) < 200
+    for names in traces.values():
+        assert sorted(names) == ["chat", "execute_code", "route_query"]
+
+def test_langsmith_mode_leaves_langchain_auto_tracing_off():
+    utils = pytest.importorskip("langsmith.utils")
+    previous = dict(tracing.config)
+    try:
+        tracing.configure(mode="langsmith", sample_rate=0.0)
+        assert os.environ["LANGCHAIN_TRACING_V2"] == "false"
+
+        @traced("chat")
+        def unsampled_chat():
+            return utils.tracing_is_enabled()
+
+        assert unsampled_chat() is False
+    finally:
+        tracing.config.update(previous)
+        tracing.configure()